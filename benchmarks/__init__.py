@@ -0,0 +1,4 @@
+"""
+Performance benchmarks of bbgregressions on synthetic deepCSA-like
+data (see benchmarks.main). Not part of the installed package.
+"""
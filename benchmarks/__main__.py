@@ -0,0 +1,4 @@
+from benchmarks.main import benchmarks
+
+if __name__ == "__main__":
+    benchmarks()
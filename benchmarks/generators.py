@@ -0,0 +1,212 @@
+"""
+Synthetic deepCSA-like tables (mutdensity, omega) and predictors
+files, to benchmark bbgregressions at any size.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.create_input.schemas.clonalstructure import MUTDENSITY_MUTTYPES, MUTDENSITY_REGIONS
+
+OMEGA_BENCH_IMPACTS = ["missense", "truncating", "nonsense"]
+
+
+def element_names(n_elements: int) -> list:
+    """
+    Gene names, plus the ALL_GENES total
+    """
+    return [f"GENE{i}" for i in range(n_elements)] + ["ALL_GENES"]
+
+
+def sample_names(n_samples: int) -> list:
+    """
+    Sample names, plus the all_samples total
+    """
+    return [f"S{i}" for i in range(n_samples)] + ["all_samples"]
+
+
+def predictors_table(n_samples: int, n_predictors: int, n_subjects: int = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Predictors file: SAMPLE_ID, SUBJECT_ID (random effect, about
+    3 samples per subject by default) and n_predictors columns,
+    alternating continuous (pred_<i>) and binary (is_<i>) ones
+    """
+    rng = np.random.default_rng(seed)
+    n_subjects = n_subjects or max(1, n_samples // 3)
+    data = {
+        "SAMPLE_ID": sample_names(n_samples)[:-1],
+        "SUBJECT_ID": [f"SUBJ{i}" for i in rng.integers(0, n_subjects, n_samples)],
+    }
+    for i in range(n_predictors):
+        if i % 2:
+            data[f"is_{i}"] = rng.integers(0, 2, n_samples)
+        else:
+            data[f"pred_{i}"] = rng.normal(0, 1, n_samples)
+
+    return pd.DataFrame(data)
+
+
+def sample_effect(predictors: pd.DataFrame) -> np.ndarray:
+    """
+    Effect of the predictors on the values of each sample (first
+    predictor, and the last one at half strength), so that some
+    predictors are significant and the multivariate models run
+    """
+    values = predictors.drop(columns=["SAMPLE_ID", "SUBJECT_ID"]).to_numpy(dtype=float)
+    if values.shape[1] == 0:
+        return np.zeros(len(predictors))
+    return 0.3 * values[:, 0] + 0.15 * values[:, -1]
+
+
+def _values(n_rows: int, effect: np.ndarray, rng) -> np.ndarray:
+    """
+    Positive values (gamma) scaled by the sample effect
+    """
+    return rng.gamma(2, 1, n_rows) * np.exp(effect)
+
+
+def cleaner_table(n_elements: int, n_samples: int, na_rate: float = 0.2, seed: int = 0) -> pd.DataFrame:
+    """
+    Elements x samples table as the cleaner gets it from the
+    formatter (with the all_samples totals column), with NAs and
+    a few constant and all-NA rows
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.gamma(2, 1, (n_elements + 1, n_samples + 1))
+    values[rng.random(values.shape) < na_rate] = np.nan
+    values[:, -1] = rng.gamma(2, 1, n_elements + 1)
+    n_special = max(1, n_elements // 100)
+    values[rng.choice(n_elements, n_special, replace=False)] = 1.5
+    values[rng.choice(n_elements, n_special, replace=False), :-1] = np.nan
+
+    return pd.DataFrame(values, index=element_names(n_elements), columns=sample_names(n_samples))
+
+
+def mutdensity_table(
+    n_elements: int, n_samples: int, effect: np.ndarray = None, na_rate: float = 0.05, seed: int = 0
+) -> pd.DataFrame:
+    """
+    deepCSA all_mutdensities table: one row per element, sample,
+    region and mutation type, with a fraction na_rate of the rows
+    missing (NAs in the input tables)
+    """
+    rng = np.random.default_rng(seed)
+    elements, samples = element_names(n_elements), sample_names(n_samples)
+    muttypes = list(MUTDENSITY_MUTTYPES.values())
+    index = pd.MultiIndex.from_product(
+        [MUTDENSITY_REGIONS, muttypes, elements, samples], names=["REGIONS", "MUTTYPES", "GENE", "SAMPLE_ID"]
+    )
+    data = index.to_frame(index=False)
+
+    # the all_samples totals do not have predictors
+    effect = np.zeros(n_samples) if effect is None else effect
+    effect = np.append(effect, 0)[np.tile(np.arange(len(samples)), len(index) // len(samples))]
+    data["MUTDENSITY_MB"] = _values(len(data), effect, rng)
+    data["MUTDENSITY_ADJUSTED"] = data["MUTDENSITY_MB"] * rng.uniform(0.9, 1.1, len(data))
+    data["MUTREADSDENSITY_MB"] = data["MUTDENSITY_MB"] * rng.uniform(1, 3, len(data))
+    data["MUTREADSDENSITY_ADJUSTED"] = data["MUTREADSDENSITY_MB"] * rng.uniform(0.9, 1.1, len(data))
+
+    return data.loc[rng.random(len(data)) >= na_rate].reset_index(drop=True)
+
+
+def omega_table(
+    n_elements: int, n_samples: int, effect: np.ndarray = None, na_rate: float = 0.05, seed: int = 0
+) -> pd.DataFrame:
+    """
+    deepCSA omega table: one row per gene, sample and impact, with
+    a fraction na_rate of the rows missing
+    """
+    rng = np.random.default_rng(seed)
+    elements, samples = element_names(n_elements), sample_names(n_samples)
+    index = pd.MultiIndex.from_product(
+        [elements, samples, OMEGA_BENCH_IMPACTS], names=["gene", "sample", "impact"]
+    )
+    data = index.to_frame(index=False)
+
+    effect = np.zeros(n_samples) if effect is None else effect
+    effect = np.append(effect, 0)[np.repeat(np.tile(np.arange(len(samples)), len(elements)), len(OMEGA_BENCH_IMPACTS))]
+    data["dnds"] = _values(len(data), effect, rng)
+    data["pvalue"] = rng.random(len(data))
+
+    return data.loc[rng.random(len(data)) >= na_rate].reset_index(drop=True)
+
+
+def write_dataset(
+    directory: str,
+    n_elements: int,
+    n_samples: int,
+    n_predictors: int,
+    na_rate: float = 0.05,
+    seed: int = 0,
+    model: str = "linear",
+    engine: str = None,
+) -> dict:
+    """
+    Writes a mutdensity table, an omega table and a predictors
+    file to directory, with a config.yml to run bbgregressions on
+    them (results in directory/output). Returns the config
+    """
+    os.makedirs(directory, exist_ok=True)
+    predictors = predictors_table(n_samples, n_predictors, seed=seed)
+    effect = sample_effect(predictors)
+    files = {
+        "mutdensity": os.path.join(directory, "all_mutdensities.tsv"),
+        "omega": os.path.join(directory, "omega.tsv"),
+        "predictors": os.path.join(directory, "predictors.tsv"),
+    }
+    mutdensity_table(n_elements, n_samples, effect, na_rate, seed).to_csv(files["mutdensity"], sep="\t", index=False)
+    omega_table(n_elements, n_samples, effect, na_rate, seed).to_csv(files["omega"], sep="\t", index=False)
+    predictors.to_csv(files["predictors"], sep="\t", index=False)
+
+    predictors_names = predictors.columns.drop(["SAMPLE_ID", "SUBJECT_ID"]).tolist()
+    config = {
+        "metrics": {
+            "metric_1": {
+                "metric_name": "mutdensity",
+                "file": files["mutdensity"],
+                "region": ["protein_affecting", "non_protein_affecting"],
+                "muttype": ["snv"],
+                "adjust": False,
+                "elements_total_by": "included",
+                "samples_total_by": "included",
+            },
+            "metric_2": {
+                "metric_name": "omega",
+                "file": files["omega"],
+                "global_loc": True,
+                "multi": False,
+                "impact": ["missense", "truncating"],
+                "elements": None,
+                "significance_threshold": 1,
+                "elements_total_by": "included",
+                "samples_total_by": "included",
+            },
+        },
+        "general": {
+            "output_dir": os.path.join(directory, "output"),
+            "handle_na": "ignore",
+            "elements": None,
+            "samples": None,
+            "input_format": None,
+            "model": model,
+            "engine": engine,
+            "fit_timeout": None,
+            "fit_maxiter": None,
+            "multi": True,
+            "predictors_file": files["predictors"],
+            "sample_column": "SAMPLE_ID",
+            "predictors": predictors_names,
+            "predictors_intercept_0": predictors_names[:1],
+            "predictor_random_effect": "SUBJECT_ID",
+            "predictors_multi_force": [", ".join(predictors_names[:2])] if n_predictors > 1 else [],
+            "correct_pvals": True,
+            "significance_threshold": 0.2,
+        },
+        "plot": {"predictors_names": None, "predictors_colors": None},
+    }
+    with open(os.path.join(directory, "config.yml"), "w") as fh:
+        yaml.dump(config, fh, sort_keys=False, default_flow_style=False)
+
+    return config
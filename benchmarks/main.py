@@ -0,0 +1,138 @@
+"""
+Benchmark runner: generates a synthetic dataset, times each stage
+and stores the results as JSON so versions can be compared.
+
+    python -m benchmarks run --elements 200 --samples 100
+    python -m benchmarks compare old.json new.json
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import warnings
+from datetime import datetime
+
+import click
+
+from src import __logger_name__, __version__
+
+RESULTS_DIR = ".benchmarks"
+
+
+def git_commit() -> str:
+    """
+    Commit of the benchmarked code, if it is a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group(context_settings={"help_option_names": ["-h", "--help"]})
+def benchmarks():
+    """bbgregressions benchmarks"""
+    pass
+
+
+@benchmarks.command(name="run", context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option("--elements", type=click.IntRange(min=1), default=100, show_default=True, help="Genes per table")
+@click.option("--samples", type=click.IntRange(min=3), default=60, show_default=True, help="Samples per table")
+@click.option("--predictors", type=click.IntRange(min=1), default=4, show_default=True, help="Predictors")
+@click.option("--na-rate", type=click.FloatRange(0, 1, max_open=True), default=0.05, show_default=True,
+            help="Fraction of missing rows in the source tables")
+@click.option("--seed", type=int, default=0, show_default=True, help="Seed of the generated data")
+@click.option("--stages", type=click.STRING, default=",".join(["readers", "cleaner", "formatter", "models", "coefplot", "heatmap"]),
+            show_default=True, callback=lambda ctx, param, value: [x.strip() for x in value.split(",")],
+            help="Stages to benchmark (comma-separated)")
+@click.option("--engine", type=click.Choice(["statsmodels", "vectorized"]), default="statsmodels",
+            show_default=True, help="Engine of the model fits")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+            help="Number of parallel processes")
+@click.option("--repeats", type=click.IntRange(min=1), default=1, show_default=True,
+            help="Timed runs per benchmark")
+@click.option("-o", "--output", type=click.Path(), default=None,
+            help=f"JSON file with the results [default: {RESULTS_DIR}/<date>_<version>.json]")
+def run(elements, samples, predictors, na_rate, seed, stages, engine, jobs, repeats, output):
+    """Benchmark the bbgregressions stages on synthetic data"""
+    from benchmarks.generators import write_dataset
+    from benchmarks.stages import (STAGES, bench_cleaner, bench_coefplot, bench_formatter, bench_heatmap, bench_models,
+                                bench_readers)
+
+    # warnings and logs of the model fits would flood the output
+    warnings.simplefilter("ignore")
+    logging.getLogger(__logger_name__).setLevel(logging.CRITICAL)
+
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise click.BadParameter(f"Unknown stages {sorted(unknown)}. Valid stages: {STAGES}")
+
+    params = {"elements": elements, "samples": samples, "predictors": predictors, "na_rate": na_rate,
+            "seed": seed, "engine": engine, "jobs": jobs, "repeats": repeats}
+    report = {
+        "version": __version__,
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bbgregressions-bench-") as directory:
+        # the cleaner runs on a table of its own
+        if set(stages) - {"cleaner"}:
+            click.echo(f"Generating data: {elements} elements x {samples} samples, {predictors} predictors")
+            config = write_dataset(directory, elements, samples, predictors, na_rate, seed, engine=engine)
+        for stage in stages:
+            click.echo(f"Benchmarking {stage}...")
+            if stage == "readers":
+                stats = bench_readers(config, repeats, jobs)
+            elif stage == "cleaner":
+                stats = bench_cleaner(elements, samples, na_rate, seed, repeats)
+            elif stage == "formatter":
+                stats = bench_formatter(config, repeats)
+            elif stage == "models":
+                stats = bench_models(config, repeats, jobs)
+            elif stage == "coefplot":
+                stats = bench_coefplot(config, repeats, jobs)
+            elif stage == "heatmap":
+                stats = bench_heatmap(config, repeats, jobs)
+            for name, values in stats.items():
+                speedup = f", {values['speedup']:.1f}x the reference" if "speedup" in values else ""
+                click.echo(f"  {name}: {values['best_seconds']:.3f}s, peak {values['peak_memory_mb']:.1f} MB{speedup}")
+            report["benchmarks"].update(stats)
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y-%m-%d_%H-%M-%S}_{__version__}.json")
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=1)
+    click.echo(f"Results saved in {output}")
+
+
+@benchmarks.command(name="compare", context_settings=dict(help_option_names=["-h", "--help"]))
+@click.argument("baseline", type=click.Path(exists=True))
+@click.argument("candidate", type=click.Path(exists=True))
+def compare(baseline, candidate):
+    """Compare two benchmark results (time and memory ratios, candidate/baseline)"""
+    reports = []
+    for file in [baseline, candidate]:
+        with open(file) as fh:
+            reports.append(json.load(fh))
+    old, new = reports
+    if old["params"] != new["params"]:
+        click.echo(f"Warning: different parameters\n  {old['params']}\n  {new['params']}")
+
+    click.echo(f"{'benchmark':<32}{'time (s)':>22}{'ratio':>8}{'peak (MB)':>24}{'ratio':>8}")
+    for name in new["benchmarks"]:
+        if name not in old["benchmarks"]:
+            continue
+        a, b = old["benchmarks"][name], new["benchmarks"][name]
+        time_ratio = b["best_seconds"] / a["best_seconds"] if a["best_seconds"] else float("nan")
+        memory_ratio = b["peak_memory_mb"] / a["peak_memory_mb"] if a["peak_memory_mb"] else float("nan")
+        click.echo(f"{name:<32}{a['best_seconds']:>10.3f} -> {b['best_seconds']:>8.3f}{time_ratio:>8.2f}"
+                f"{a['peak_memory_mb']:>10.1f} -> {b['peak_memory_mb']:>10.1f}{memory_ratio:>8.2f}")
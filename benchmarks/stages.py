@@ -0,0 +1,235 @@
+"""
+Timed and memory-tracked benchmarks of each bbgregressions stage,
+run on a dataset written by benchmarks.generators.write_dataset.
+"""
+import copy
+import gc
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.generators import cleaner_table
+from src.create_input.cleaner import clean_reps, handle_nan
+from src.create_input.formatter import formatter
+from src.create_input.loader import read_source
+from src.create_input.main import update_config
+from src.create_input.schemas.globals import get_reader
+from src.plot.coefplot.main import main as coefplot_main
+from src.plot.heatmap.main import main as heatmap_main
+from src.regressions.main import MODE_DIRS, save_metric
+from src.regressions.models import main as run_model
+from src.regressions.utils import clean_input, clean_multi, init_storage, multi_rules
+from src.regressions.schema import MODEL_OPTIONS
+
+STAGES = ["readers", "cleaner", "formatter", "models", "coefplot", "heatmap"]
+
+
+def measure(func, *args, repeats: int = 1, **kwargs) -> tuple:
+    """
+    Runs func repeats times for timing, then once more with
+    tracemalloc for the peak of memory allocated (in this process,
+    so worker processes are not included). Returns the result of
+    the last run and its stats
+    """
+    seconds = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = {
+        "seconds": seconds,
+        "best_seconds": min(seconds),
+        "mean_seconds": sum(seconds) / len(seconds),
+        "peak_memory_mb": peak / 2**20,
+    }
+    return (result, stats)
+
+
+def metric_configs(config: dict) -> dict:
+    """
+    Config of each metric, completed with the general config
+    """
+    configs = {}
+    for metric_config in copy.deepcopy(config["metrics"]).values():
+        metric_config = update_config(metric_config, config["general"])
+        metric_config["input_format"] = config["general"].get("input_format")
+        configs[metric_config["metric_name"]] = metric_config
+    return configs
+
+
+def bench_readers(config: dict, repeats: int = 1, jobs: int = 1) -> dict:
+    """
+    Readers of every metric (load, filter and format the tables,
+    kept in memory)
+    """
+    output_dir = os.path.join(config["general"]["output_dir"], "input")
+    stats = {}
+    for metric, metric_config in metric_configs(config).items():
+        reader = get_reader(metric)
+        _, stats[f"reader.{metric}"] = measure(reader, metric_config, output_dir, jobs, keep=True, repeats=repeats)
+    return stats
+
+
+def apply_clean_reps(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    clean_reps as it was before it was vectorized (nunique per row),
+    the reference its results must match
+    """
+    return data.loc[data.nunique(axis=1) > 1]
+
+
+def apply_handle_nan(data: pd.DataFrame, config: dict) -> pd.DataFrame:
+    """
+    handle_nan as it was before it was vectorized (row and column
+    applies), the reference its results must match
+    """
+    if config["handle_na"] == "mean":
+        return data.apply(lambda row: row.fillna(row.mean()), axis=1)
+    if config["handle_na"] == "cohort":
+        total_col = "all_samples" if "all_samples" in data.columns else "total_sample"
+        return data.apply(lambda col: col.fillna(data[total_col]))
+    return data
+
+
+def bench_cleaner(n_elements: int, n_samples: int, na_rate: float = 0.05, seed: int = 0, repeats: int = 1) -> dict:
+    """
+    clean_reps and handle_nan (mean and cohort) on an elements x
+    samples table, and their previous (apply-based) versions. Fails
+    if the results differ from those of the previous versions
+    """
+    data = cleaner_table(n_elements, n_samples, na_rate, seed)
+    runs = {"clean_reps": (clean_reps, apply_clean_reps, ())}
+    for option in ["mean", "cohort"]:
+        runs[f"handle_nan.{option}"] = (handle_nan, apply_handle_nan, ({"handle_na": option},))
+
+    stats = {}
+    for name, (func, reference, args) in runs.items():
+        result, stats[f"cleaner.{name}"] = measure(func, data, *args, repeats=repeats)
+        expected, stats[f"cleaner.{name}.reference"] = measure(reference, data, *args, repeats=repeats)
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+        stats[f"cleaner.{name}"]["speedup"] = (stats[f"cleaner.{name}.reference"]["best_seconds"]
+                                            / stats[f"cleaner.{name}"]["best_seconds"])
+    return stats
+
+
+def bench_formatter(config: dict, repeats: int = 1) -> dict:
+    """
+    formatter on one mutdensity table (protein_affecting, snv)
+    """
+    metric_config = metric_configs(config)["mutdensity"]
+    metric = f"{metric_config['metric_name'].upper()}_MB"
+    dtypes = {"GENE": "category", "SAMPLE_ID": "category", "REGIONS": "category", "MUTTYPES": "category",
+            metric: "float64"}
+    filters = {"REGIONS": ["protein_affecting"], "MUTTYPES": ["SNV"]}
+    data, levels = read_source(metric_config["file"], dtypes, filters, levels=["GENE", "SAMPLE_ID"])
+    data = data.rename({"GENE": "element", "SAMPLE_ID": "sample"}, axis=1)
+
+    output_dir = os.path.join(config["general"]["output_dir"], "input")
+    _, stats = measure(formatter, data, metric, "protein_affecting.snv", metric_config, levels["GENE"],
+                    levels["SAMPLE_ID"], output_dir, keep=True, repeats=repeats)
+    return {"formatter.mutdensity": stats}
+
+
+def input_table(config: dict) -> tuple:
+    """
+    mutdensity input table (protein_affecting, snv) merged with
+    the predictors, as regressions runs the models on it
+    """
+    metric_config = metric_configs(config)["mutdensity"]
+    output_dir = os.path.join(config["general"]["output_dir"], "input")
+    _, tables = get_reader("mutdensity")(metric_config, output_dir, keep=True)
+    stem = [stem for stem in tables if stem.endswith("protein_affecting.snv")][0]
+    data = clean_input(tables[stem])
+    elements = data.columns
+    predictors_data = pd.read_csv(config["general"]["predictors_file"], sep="\t",
+                                index_col=config["general"]["sample_column"])
+    data = data.merge(predictors_data, right_index=True, left_index=True, how="left")
+    return (stem, data, elements)
+
+
+def run_models(data: pd.DataFrame, elements: list, config: dict, jobs: int = 1) -> dict:
+    """
+    Univariate models, then multivariate ones on the predictors
+    selected from the univariate results
+    """
+    predictors = config["predictors"]
+    results_uni = run_model(data, init_storage(elements, predictors), elements, predictors, config,
+                            mode="uni", jobs=jobs)
+    results = {"uni": results_uni}
+    if config["multi"]:
+        elements_m, predictors_m, forced = multi_rules(results_uni, config)
+        results_multi = run_model(data, init_storage(elements, predictors), elements_m, predictors_m, config,
+                                mode="multi", jobs=jobs)
+        if forced:
+            results_multi = clean_multi(results_multi, elements_m, forced)
+        results["multi"] = results_multi
+    return results
+
+
+def bench_models(config: dict, repeats: int = 1, jobs: int = 1, models: list = MODEL_OPTIONS) -> dict:
+    """
+    regressions.models.main in uni and multi mode for each model,
+    on one mutdensity input table
+    """
+    _, data, elements = input_table(config)
+    stats = {}
+    for model in models:
+        model_config = dict(config["general"], model=model)
+        predictors = model_config["predictors"]
+        results_uni, stats[f"models.{model}.uni"] = measure(
+            run_model, data, init_storage(elements, predictors), elements, predictors, model_config,
+            mode="uni", jobs=jobs, repeats=repeats)
+
+        elements_m, predictors_m, _ = multi_rules(results_uni, model_config)
+        _, stats[f"models.{model}.multi"] = measure(
+            run_model, data, init_storage(elements, predictors), elements_m, predictors_m, model_config,
+            mode="multi", jobs=jobs, repeats=repeats)
+        stats[f"models.{model}.multi"]["elements"] = len(elements_m)
+    return stats
+
+
+def write_results(config: dict) -> None:
+    """
+    Writes the results of one mutdensity input table (univariate
+    and multivariate), for the plots
+    """
+    stem, data, elements = input_table(config)
+    general_config = config["general"]
+    results = run_models(data, elements, general_config)
+    metric_dir = os.path.join(general_config["output_dir"], "regressions", general_config["model"],
+                            os.path.basename(stem))
+    for mode in results:
+        os.makedirs(os.path.join(metric_dir, MODE_DIRS[mode]), exist_ok=True)
+    save_metric(metric_dir, results)
+
+
+def bench_coefplot(config: dict, repeats: int = 1, jobs: int = 1) -> dict:
+    """
+    coefplot of the results of one mutdensity input table
+    (univariate and multivariate pdfs)
+    """
+    write_results(config)
+    _, stats = measure(coefplot_main, config, force=True, jobs=jobs, repeats=repeats)
+    return {"coefplot": stats}
+
+
+def bench_heatmap(config: dict, repeats: int = 1, jobs: int = 1, top: int = 50) -> dict:
+    """
+    heatmap (clustered, with top zoom pages) of the results of one
+    mutdensity input table
+    """
+    write_results(config)
+    _, stats = measure(heatmap_main, config, force=True, jobs=jobs, top=top, repeats=repeats)
+    return {"heatmap": stats}
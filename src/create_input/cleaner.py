@@ -1,3 +1,6 @@
+import warnings
+
+import numpy as np
 import pandas as pd
 import daiquiri
 
@@ -24,11 +27,17 @@ def clean_reps(data: pd.DataFrame) -> pd.DataFrame:
     """
     """
     logger.info("QC: identical values")
-    elements2remove = data.loc[data.nunique(axis = 1) == 1].index.tolist()
+    # a single distinct value when the row min and max (ignoring NAs) are the same,
+    # all NA rows get min > max
+    values = data.to_numpy(dtype = float)
+    observed = ~np.isnan(values)
+    row_min = np.min(values, axis = 1, initial = np.inf, where = observed)
+    row_max = np.max(values, axis = 1, initial = -np.inf, where = observed)
+    elements2remove = data.index[row_min == row_max].tolist()
     if elements2remove:
         logger.info(f"Identical values across samples for the following elements: {elements2remove}")
         logger.info("Elements removed from the analysis")
-        data = data.loc[data.nunique(axis = 1) > 1]
+        data = data.loc[row_min < row_max]
     else:
         logger.info("No element has identical values across samples. Kept all.")
 
@@ -43,14 +52,24 @@ def handle_nan(data: pd.DataFrame,
         logger.info("Option: ignore. Keeping NAs")
     elif config["handle_na"] == "mean":
         logger.info("Option: mean. NAs filled with mean per element")
-        data = data.apply(lambda row: row.fillna(row.mean()), axis = 1)
+        # rows contiguous, so each row is summed as pandas does for a single row
+        values = np.ascontiguousarray(data.to_numpy(dtype = float))
+        missing = np.isnan(values)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning) # all NA rows stay NA
+            row_mean = np.nanmean(values, axis = 1)
+        data = pd.DataFrame(np.where(missing, row_mean[:, None], values),
+                            index = data.index, columns = data.columns)
     elif config["handle_na"] == "cohort":
         logger.info("Option: cohort. NAs filled with the totals value per elements")
         if "all_samples" in data.columns:
             total_col = "all_samples"
         else:
             total_col = "total_sample"
-        data = data.apply(lambda col: col.fillna(data[total_col]))
+        values = data.to_numpy(dtype = float)
+        total = data[total_col].to_numpy(dtype = float)
+        data = pd.DataFrame(np.where(np.isnan(values), total[:, None], values),
+                            index = data.index, columns = data.columns)
     
     return data
 
@@ -1,5 +1,4 @@
 import os
-import re
 
 import daiquiri
 import pandas as pd
@@ -7,24 +6,38 @@ import pandas as pd
 from src import __logger_name__
 from src.create_input.addon import add_totals
 from src.create_input.cleaner import clean_nan, clean_reps, handle_nan
+from src.create_input.selection import needs_matching, select
+from src.utils.io import DEFAULT_TABLE_FORMAT, write_table
+from src.utils.profiling import profiled
 
 logger = daiquiri.getLogger(__logger_name__)
 
 
+@profiled
 def formatter(
-    data: pd.DataFrame, metric: str, filters: str, config: dict, elements: list, samples: list, output_dir: str
-) -> None:
-    """ """
-
-    # check if elements and/or samples were provided as regex
-    if isinstance(elements, str):
-        regex = f'r"{elements}"'
-        allelements = data["element"].unique()
-        elements = [elem for elem in allelements if re.search(regex, elem)]
-    if isinstance(samples, str):
-        regex = samples
-        allsamples = data["sample"].unique()
-        samples = [sampl for sampl in allsamples if re.search(regex, sampl)]
+    data: pd.DataFrame,
+    metric: str,
+    filters: str,
+    config: dict,
+    elements: list,
+    samples: list,
+    output_dir: str,
+    keep: bool = False,
+) -> tuple:
+    """
+    Builds and saves one regressions input table.
+    Returns the paths of the saved files and, with keep, the table
+    by path stem instead of saving it (written later by the caller)
+    """
+
+    # labels as plain strings (categorical ones would keep unobserved categories)
+    data = data.astype({"element": str, "sample": str})
+
+    # resolve elements and/or samples provided as regex or glob patterns
+    if needs_matching(elements):
+        elements = select(data["element"].unique(), elements, key=(config.get("file"), "element"))
+    if needs_matching(samples):
+        samples = select(data["sample"].unique(), samples, key=(config.get("file"), "sample"))
 
     # pivot and reindex with selected elements and samples
     data_p = data.pivot(values=metric, index="element", columns="sample")
@@ -45,9 +58,11 @@ def formatter(
     data_ok = data_ok.T
 
     # save
-    file = os.path.join(output_dir, f"{metric.lower()}.{filters}.tsv")
+    stem = os.path.join(output_dir, f"{metric.lower()}.{filters}")
     logger.info(f"Input generated for {metric}")
-    data_ok.to_csv(file, sep="\t")
-    logger.info(f"Saved as {file}")
+    if keep:
+        return ([], {stem: data_ok})
+    files = write_table(data_ok, stem, config.get("input_format") or DEFAULT_TABLE_FORMAT)
+    logger.info(f"Saved as {', '.join(files)}")
 
-    return None
+    return (files, {})
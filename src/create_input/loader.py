@@ -0,0 +1,87 @@
+import daiquiri
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from src import __logger_name__
+from src.create_input.selection import selection_mask
+from src.utils.profiling import profiled
+
+logger = daiquiri.getLogger(__logger_name__)
+
+# rows parsed at a time from the source tables
+CHUNK_SIZE = 1_000_000
+
+
+def row_mask(chunk: pd.DataFrame, filters: dict, file: str = None) -> np.ndarray:
+    """
+    Rows of the chunk passing all the filters. Each filter maps a
+    column to a selection (regular expression, or list of names and
+    glob patterns) or to a function returning a boolean mask for
+    the column. Selection matches are cached per file and column
+    """
+
+    mask = np.ones(len(chunk), dtype=bool)
+    for column, keep in filters.items():
+        if callable(keep):
+            mask &= np.asarray(keep(chunk[column]), dtype=bool)
+        else:
+            mask &= selection_mask(chunk[column], keep, key=(file, column))
+
+    return mask
+
+
+@profiled
+def read_source(file: str, dtypes: dict, filters: dict = None, levels: list = ()) -> tuple:
+    """
+    Reads a tab-separated source table (e.g. from deepCSA) in chunks,
+    keeping only the columns in dtypes and the rows passing the
+    filters, so memory follows the filtered table rather than the
+    whole file. Compressed files (.gz, .bz2, .xz, .zst) are streamed.
+
+    Parameters
+    ----------
+    file: str
+        path to the table
+    dtypes: dict
+        columns to load and their dtypes (category for labels)
+    filters: dict
+        column to values to keep (see row_mask)
+    levels: list
+        columns whose (non-missing) values are also collected
+        before filtering
+
+    Returns
+    -------
+    tuple
+        filtered table and, for each column in levels, its values
+        in order of appearance in the whole file
+    """
+
+    chunks = []
+    n_rows = 0
+    seen = {column: {} for column in levels}
+    with pd.read_csv(file, sep="\t", usecols=list(dtypes), dtype=dtypes,
+                    compression="infer", chunksize=CHUNK_SIZE) as reader:
+        for chunk in reader:
+            n_rows += len(chunk)
+            for column in levels:
+                seen[column].update(dict.fromkeys(chunk[column].dropna().unique()))
+            if filters:
+                chunk = chunk.loc[row_mask(chunk, filters, file)]
+            chunks.append(chunk)
+    levels = {column: list(values) for column, values in seen.items()}
+    if not chunks:
+        return (pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()}), levels)
+
+    # categories may differ between chunks
+    data = {}
+    for column, dtype in dtypes.items():
+        if dtype == "category":
+            data[column] = union_categoricals([chunk[column] for chunk in chunks])
+        else:
+            data[column] = np.concatenate([chunk[column].to_numpy() for chunk in chunks])
+    data = pd.DataFrame(data)
+    logger.debug(f"Loaded {len(data)} of {n_rows} rows from {file}")
+
+    return (data, levels)
@@ -1,12 +1,14 @@
+import copy
 import os
 
 import daiquiri
 
 from src import __logger_name__
-from src.create_input.readers.clonalstructure import *
-from src.create_input.schemas.globals import METRIC2READER
+from src.create_input.schemas.globals import get_reader
 from src.globals import GENERAL_CONFIG_OPTIONS
-from src.utils.io import read_yaml
+from src.utils.cache import fingerprint, is_fresh, load_cache, record, save_cache
+from src.utils.io import DEFAULT_TABLE_FORMAT, read_config, table_files, write_table
+from src.utils.profiling import profiled
 
 logger = daiquiri.getLogger(__logger_name__)
 
@@ -21,10 +23,18 @@ def update_config(metric_config: dict, general_config: dict) -> dict:
     return metric_config
 
 
-def main(config_file: str) -> None:
-    """ """
+@profiled
+def main(config_file, force: bool = False, jobs: int = 1, memory: dict = None, writer=None) -> None:
+    """
+    Generates the input tables of every metric. Metrics whose
+    source file and settings did not change since their tables
+    were generated are skipped, unless force is set.
+    With a memory dict and a background writer (in-memory pipeline),
+    the tables are kept in memory by file path for the next stage
+    and written by the writer.
+    """
 
-    config = read_yaml(config_file)
+    config = read_config(config_file)
     metrics_config = config["metrics"]
     general_config = config["general"]
 
@@ -32,6 +42,7 @@ def main(config_file: str) -> None:
     os.makedirs(output_dir, exist_ok=True)
     logger.info(f"Input tables will be stored in {output_dir}")
 
+    cache = load_cache(general_config["output_dir"], "create_input")
     for metric in metrics_config:
         metric_config = metrics_config[metric]
         logger.info(f"### Processing {metric.upper()}: {metric_config['metric_name']} ###")
@@ -41,8 +52,29 @@ def main(config_file: str) -> None:
                 logger.info(f"\t{elem}: {metric_config[elem]}")
 
         metric_config = update_config(metric_config, general_config)
-        reader = METRIC2READER[metric_config["metric_name"]]
+        metric_config["input_format"] = general_config.get("input_format")
+        key = fingerprint([metric_config["file"]], metric_config, cache)
+        if not force and is_fresh(cache, metric, key):
+            logger.info(f"Input tables of {metric} are up to date. Skipping (use --force to regenerate)")
+            continue
+
+        reader = get_reader(metric_config["metric_name"])
         logger.debug(f"Selected reader: {reader}")
-        reader(metric_config, output_dir)
+        if writer is None:
+            files, _ = reader(metric_config, output_dir, jobs)
+        else:
+            _, tables = reader(metric_config, output_dir, jobs, keep=True)
+            table_format = metric_config["input_format"] or DEFAULT_TABLE_FORMAT
+            files = []
+            for stem, table in tables.items():
+                files += table_files(stem, table_format)
+                memory[table_files(stem, table_format)[0]] = table
+                writer.submit(write_table, table, stem, table_format)
+        record(cache, metric, key, files)
+        if writer is None:
+            save_cache(general_config["output_dir"], "create_input", cache)
+        else:
+            # saved once the tables are written
+            writer.submit(save_cache, general_config["output_dir"], "create_input", copy.deepcopy(cache))
 
     return None
@@ -1,14 +1,17 @@
 import daiquiri
+import numpy as np
 import pandas as pd
 from src import __logger_name__
 
 from src.create_input.formatter import formatter
+from src.create_input.loader import read_source
+from src.utils.parallel import parallel_map
 from src.create_input.schemas.clonalstructure import *
 
 logger = daiquiri.getLogger(__logger_name__)
 
 
-def mutdensity(config: dict, output_dir: str) -> pd.DataFrame:
+def mutdensity(config: dict, output_dir: str, jobs: int = 1, keep: bool = False) -> tuple:
     """
     Reads and filters mutdensity and mutreadsdensity
     data from deepCSA. Calls formatter to produce
@@ -18,13 +21,21 @@ def mutdensity(config: dict, output_dir: str) -> pd.DataFrame:
     ----------
     config: dict
         filtering info and file name
+    output_dir: str
+        directory where the tables are saved
+    jobs: int
+        number of tables formatted in parallel
+    keep: bool
+        return the tables instead of saving them
+
+    Returns
+    -------
+    tuple
+        paths of the saved input tables and the tables
+        kept in memory, by path stem
 
     """
 
-    # load data
-    data = pd.read_csv(config["file"], sep="\t")
-    data = data.rename({"GENE": "element", "SAMPLE_ID": "sample"}, axis=1)
-
     # read filters
     metric = f"{config['metric_name'].upper()}_MB"
     metric = f"{config['metric_name'].upper()}_ADJUSTED" if config["adjust"] else metric
@@ -34,32 +45,62 @@ def mutdensity(config: dict, output_dir: str) -> pd.DataFrame:
         if not config["muttype"]
         else [MUTDENSITY_MUTTYPES[muttype] for muttype in config["muttype"]]
     )
-    elements = data["element"].unique() if not config["elements"] else config["elements"]
-    samples = data["sample"].unique() if not config["samples"] else config["samples"]
 
-    # filter data and prepare for formatter
+    # load data (only the needed columns and rows)
+    filters = {"REGIONS": list(regions), "MUTTYPES": list(muttypes)}
+    if config["elements"]:
+        filters["GENE"] = config["elements"]
+    if config["samples"]:
+        filters["SAMPLE_ID"] = config["samples"]
+    dtypes = {"GENE": "category", "SAMPLE_ID": "category", "REGIONS": "category", "MUTTYPES": "category", metric: "float64"}
+    data, levels = read_source(config["file"], dtypes, filters, levels=["GENE", "SAMPLE_ID"])
+    data = data.rename({"GENE": "element", "SAMPLE_ID": "sample"}, axis=1)
+
+    elements = levels["GENE"] if not config["elements"] else config["elements"]
+    samples = levels["SAMPLE_ID"] if not config["samples"] else config["samples"]
+
+    # split the data once by filter combination and prepare for formatter
+    slices = dict(list(data.groupby(["REGIONS", "MUTTYPES"], observed=True, sort=False)))
+    tasks = []
     for region in regions:
         for muttype in muttypes:
-            data_f = data.loc[(data["REGIONS"] == region) & (data["MUTTYPES"] == muttype)]
+            data_f = slices.get((region, muttype), data.iloc[:0])
 
             logger.info("Generating table with these filter combination:")
             logger.info(f"\tRegion: {region}")
             logger.info(f"\tMutation type: {muttype.lower()}")
             filters = f"{region}.{muttype.lower()}"
-            formatter(
-                data=data_f,
-                metric=metric,
-                filters=filters,
-                config=config,
-                elements=elements,
-                samples=samples,
-                output_dir=output_dir,
-            )
+            tasks.append((data_f, metric, filters, config, elements, samples, output_dir, keep))
 
-    return None
+    if jobs > 1:
+        logger.info(f"Formatting {len(tasks)} tables in {jobs} parallel processes")
+    files, tables = [], {}
+    for files_f, tables_f in parallel_map(formatter, tasks, jobs):
+        files += files_f
+        tables.update(tables_f)
 
+    return (files, tables)
 
-def omega(config: dict, output_dir: str) -> pd.DataFrame:
+
+def impact_labels(genes: pd.Series, impacts: pd.Series) -> pd.Categorical:
+    """
+    Labels each row as <gene>_<impact>. Both columns are categorical,
+    so labels are only built once per gene-impact pair present.
+    """
+
+    n_impacts = len(impacts.cat.categories)
+    pairs = genes.cat.codes.to_numpy(dtype=np.int64) * n_impacts + impacts.cat.codes.to_numpy()
+    missing = (genes.cat.codes.to_numpy() < 0) | (impacts.cat.codes.to_numpy() < 0)
+    uniq_pairs, codes = np.unique(pairs[~missing], return_inverse=True)
+    labels = [f"{genes.cat.categories[pair // n_impacts]}_{impacts.cat.categories[pair % n_impacts]}"
+            for pair in uniq_pairs]
+    all_codes = np.full(len(pairs), -1)
+    all_codes[~missing] = codes
+
+    return pd.Categorical.from_codes(all_codes, categories=labels)
+
+
+def omega(config: dict, output_dir: str, jobs: int = 1, keep: bool = False) -> tuple:
     """
     Reads and filters omega data from deepCSA.
     Calls formatter to produce a regressions input
@@ -69,27 +110,43 @@ def omega(config: dict, output_dir: str) -> pd.DataFrame:
     ----------
     config: dict
         filtering info and file name
+    output_dir: str
+        directory where the tables are saved
+    jobs: int
+        number of tables formatted in parallel
+    keep: bool
+        return the tables instead of saving them
+
+    Returns
+    -------
+    tuple
+        paths of the saved input tables and the tables
+        kept in memory, by path stem
 
     """
 
-    # load data
-    data = pd.read_csv(config["file"], sep="\t")
-    data = data.rename({"gene": "element", "sample": "sample", "dnds": "omega"}, axis=1)
-
     # read filters
     impacts = OMEGA_IMPACTS if not config["impact"] else config["impact"]
+    sign_thres = 1.01 if config["significance_threshold"] == 1 else config["significance_threshold"]
+
+    # load data (only the needed columns and rows)
+    filters = {"impact": impacts, "pvalue": lambda pvalue: pvalue < sign_thres}
+    if config["samples"]:
+        filters["sample"] = config["samples"]
+    dtypes = {"gene": "category", "sample": "category", "impact": "category", "dnds": "float64", "pvalue": "float64"}
+    data, levels = read_source(config["file"], dtypes, filters, levels=["gene", "sample"])
+    data = data.rename({"gene": "element", "sample": "sample", "dnds": "omega"}, axis=1)
+
     if not config["elements"]:
-        # elements = [elem for elem in data["element"].unique() if "--" not in elem] # removes sub-genic regions
-        elements = [f"{elem}_{impact}" for impact in impacts for elem in elements]
+        # all genes in the data, without sub-genic regions, for each impact
+        genes = [gene for gene in levels["gene"] if "--" not in gene]
+        elements = [f"{gene}_{impact}" for impact in impacts for gene in genes]
     else:
         elements = config["elements"]
-    samples = data["sample"].unique() if not config["samples"] else config["samples"]
-    sign_thres = 1.01 if config["significance_threshold"] == 1 else config["significance_threshold"]
+    samples = levels["sample"] if not config["samples"] else config["samples"]
 
-    # filter data and prepare for formatter
-    data_f = data.loc[data["impact"].isin(impacts)]
-    data_f = data_f.loc[data_f["pvalue"] < sign_thres]
-    data_f["element"] = data_f.apply(lambda row: f"{row['element']}_{row['impact']}", axis=1)
+    # label elements by impact and prepare for formatter
+    data_f = data.assign(element=impact_labels(data["element"], data["impact"]))
     logger.info("Generating table with these filter combination:")
     logger.info(f"\tImpacts: {impacts}")
     logger.info(f"\tGlobal loc mode: {config['global_loc']}")
@@ -101,7 +158,7 @@ def omega(config: dict, output_dir: str) -> pd.DataFrame:
         "no-significance-thres" if config["significance_threshold"] == 1 else f"significance-thres-{sign_thres}"
     )
     filters = f"{globalloc_label}.{multi_label}.{sign_thres_label}"
-    formatter(
+    files, tables = formatter(
         data=data_f,
         metric=config["metric_name"],
         filters=filters,
@@ -109,6 +166,7 @@ def omega(config: dict, output_dir: str) -> pd.DataFrame:
         elements=elements,
         samples=samples,
         output_dir=output_dir,
+        keep=keep,
     )
 
-    return None
+    return (files, tables)
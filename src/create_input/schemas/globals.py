@@ -1,8 +1,17 @@
-from src.create_input.readers.clonalstructure import *
+import importlib
 
+# reader of each metric (module:function), imported when it is used
 METRIC2READER = {
-    "mutdensity": mutdensity,
-    "mutreadsdensity": mutdensity,
-    # "oncodrivefml": oncodrivefml,
-    "omega": omega,
+    "mutdensity": "src.create_input.readers.clonalstructure:mutdensity",
+    "mutreadsdensity": "src.create_input.readers.clonalstructure:mutdensity",
+    # "oncodrivefml": "src.create_input.readers.oncodrivefml:oncodrivefml",
+    "omega": "src.create_input.readers.clonalstructure:omega",
 }
+
+
+def get_reader(metric: str):
+    """
+    Reader function of a metric, importing its module on demand
+    """
+    module, function = METRIC2READER[metric].split(":")
+    return getattr(importlib.import_module(module), function)
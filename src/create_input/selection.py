@@ -0,0 +1,118 @@
+import fnmatch
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# characters that make a list entry a glob pattern instead of a name
+GLOB_CHARS = set("*?[")
+
+# matches already computed, by (source file, axis or column, pattern),
+# the least recently used dropped beyond MAX_MATCHES
+MATCHES = {}
+MAX_MATCHES = 64
+
+
+def is_glob(name) -> bool:
+    """
+    Whether a list entry is a glob pattern (e.g. TP53*)
+    """
+    return isinstance(name, str) and bool(GLOB_CHARS.intersection(name))
+
+
+def compile_selection(selection) -> re.Pattern:
+    """
+    Single regular expression for a selection of elements or samples:
+    a string is used as a regular expression (searched anywhere in
+    the name), a list matches its names exactly or its glob patterns
+    """
+
+    return compile_cached(selection if isinstance(selection, str) else tuple(selection))
+
+
+@lru_cache(maxsize=256)
+def compile_cached(selection) -> re.Pattern:
+    """
+    compile_selection of a hashable selection (str or tuple)
+    """
+
+    if isinstance(selection, str):
+        return re.compile(selection)
+    parts = [fnmatch.translate(name) if is_glob(name) else re.escape(str(name)) + r"\Z" for name in selection]
+
+    return re.compile("^(?:" + "|".join(parts) + ")")
+
+
+def match_values(values, selection, key: tuple = None) -> np.ndarray:
+    """
+    Boolean mask of the values matching the selection. With a key
+    (e.g. source file and axis), matches are cached and reused by
+    later calls with the same selection
+    """
+
+    values = pd.Index(values)
+    if values.empty:
+        return np.zeros(0, dtype=bool)
+    pattern = compile_selection(selection)
+    cache_key = (key, pattern.pattern) if key is not None else None
+    # most recently used last
+    cached = MATCHES.pop(cache_key, None)
+
+    missing = values.unique() if cached is None else values[~values.isin(cached.index)].unique()
+    if len(missing):
+        found = pd.Series(missing.astype(str)).str.contains(pattern, regex=True).to_numpy(dtype=bool)
+        found = pd.Series(found, index=missing)
+        cached = found if cached is None else pd.concat([cached, found])
+    if cache_key is not None:
+        MATCHES[cache_key] = cached
+        while len(MATCHES) > MAX_MATCHES:
+            del MATCHES[next(iter(MATCHES))]
+
+    return cached.reindex(values).to_numpy(dtype=bool)
+
+
+def selection_mask(column: pd.Series, selection, key: tuple = None) -> np.ndarray:
+    """
+    Rows of a column matching the selection. Categorical columns
+    are matched once per category
+    """
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        matched = match_values(column.cat.categories, selection, key)
+        codes = column.cat.codes.to_numpy()
+        return np.where(codes >= 0, matched[codes], False)
+
+    uniq, codes = np.unique(column.to_numpy(dtype=str), return_inverse=True)
+    return match_values(uniq, selection, key)[codes]
+
+
+def select(values, selection, key: tuple = None) -> list:
+    """
+    Values to keep (in their order) given a selection: a regular
+    expression (str) or a list of names and glob patterns. Names in
+    lists are kept as listed and globs are replaced by the values
+    they match
+    """
+
+    values = pd.Index(values)
+    if isinstance(selection, str):
+        return values[match_values(values, selection, key)].tolist()
+
+    selected = []
+    for name in selection:
+        if is_glob(name):
+            selected += values[match_values(values, [name], key)].tolist()
+        else:
+            selected.append(name)
+
+    return selected
+
+
+def needs_matching(selection) -> bool:
+    """
+    Whether a selection has to be resolved against the data
+    (regular expression or list with glob patterns)
+    """
+
+    return isinstance(selection, str) or any(is_glob(name) for name in selection)
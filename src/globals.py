@@ -1,5 +1,7 @@
 import logging
 import os
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
 
@@ -7,8 +9,8 @@ import click
 import daiquiri
 
 from src import __logger_name__
+from src.utils import profiling
 
-from src.regressions.models import MODELS
 from src.regressions.schema import *
 
 logger = daiquiri.getLogger(__logger_name__)
@@ -46,11 +48,45 @@ def setup_logging_decorator(func):
             ),
         )
 
-        return func(*args, **kwargs)
+        # groups (e.g. plot) are profiled within their commands
+        if not ctx.find_root().params.get("profile", False) or isinstance(ctx.command, click.Group):
+            return func(*args, **kwargs)
+
+        profiling.enable()
+        start = time.perf_counter()
+        try:
+            with profiling.timer(command_name):
+                return func(*args, **kwargs)
+        finally:
+            report_file = os.path.join(log_dir, f"{command_name}_{DATE}.run_report.json")
+            profiling.write_report(report_file, command_name, ctx.params, time.perf_counter() - start)
+            logger.info(f"Run report saved in {report_file}")
 
     return wrapper
 
 
+@contextmanager
+def log_context(context: str):
+    """
+    Labels every message logged within the block (including
+    warnings captured from other libraries) with context, so
+    output of processes running side by side stays readable
+    """
+
+    def context_filter(record):
+        record.msg = f"[{context}] {record.msg}"
+        return True
+
+    loggers = [logging.getLogger(__logger_name__), logging.getLogger("py.warnings")]
+    for log in loggers:
+        log.addFilter(context_filter)
+    try:
+        yield
+    finally:
+        for log in loggers:
+            log.removeFilter(context_filter)
+
+
 def startup_message(version, initializing_text):
     author = "Biomedical Genomics Lab - IRB Barcelona"
     support_email = "raquel.blanco@irbbarcelona.org"
@@ -86,7 +122,11 @@ CONFIG_TEMPLATE_GENERAL = {
     "handle_na": f"select between {', '.join(GENERAL_CONFIG_OPTIONS['handle_na'])} (move this field to the specific metric section if you want a metric-specific NA handling)",
     "elements": "add list of elements or regex. Move this field to the specific metric section if the subset by elements is not general",
     "samples": "add list of samples or regex. Move this field to the specific metric section if the subset by samples is not general",
-    "model": f"select between {', '.join(MODELS)}",
+    "input_format": f"select between {', '.join(TABLE_FORMATS)} (format of the input tables: npy is binary and faster to load, both also writes tsv; leave empty for {DEFAULT_TABLE_FORMAT})",
+    "model": f"select between {', '.join(MODEL_OPTIONS)}",
+    "engine": f"select between {', '.join(ENGINE_OPTIONS)} (vectorized fits all elements at once, for linear and linear-mixed-effects; leave empty for {DEFAULT_ENGINE})",
+    "fit_timeout": "maximum seconds per model fit, fits over it are set to NA and listed in diagnostics.tsv (leave empty for no limit)",
+    "fit_maxiter": "maximum optimizer iterations per mixed-effects fit (leave empty for the statsmodels default)",
     "multi": f"select between {', '.join(MULTI_OPTIONS)}",
     "predictors_file": "path/to/file (tab-delimited, predictors codified as 0/1 if binary)",
     "sample_column": "add sample column name in predictors file",
@@ -99,6 +139,7 @@ CONFIG_TEMPLATE_GENERAL = {
     ],
     "correct_pvals": "select between yes or no",
     "significance_threshold": "leave empty if no multiple testing correction",
+    "results_store": "select between yes or no (also store the results in <output_dir>/regressions/results.sqlite, for bbgregressions results query; leave empty for no)",
 }
 
 CONFIG_TEMPLATE_PLOT = {
@@ -114,3 +155,17 @@ DEFAULT_CONFIG_PLOT = {
     "coeffdot_size": 150,
     "coeffdot_linewidth": 2,
 }
+
+HEATMAP_ORDERS = ["clustered", "input"]
+
+DEFAULT_CONFIG_HEATMAP = {
+    "heatmap_width": 10,
+    "heatmap_height": 14,
+    "heatmap_dpi": 150,  # resolution of the rasterized heatmaps
+    "heatmap_cmap": "RdBu_r",
+    "heatmap_faded": 0.25,  # opacity of non-significant cells
+    "heatmap_max_labels": 100,  # more rows are drawn without labels
+    "heatmap_rows_per_page": 50,  # rows of the top-N pages
+    "heatmap_cluster_max": 4000,  # more rows are clustered through k-means centroids
+    "heatmap_centroids": 500,
+}
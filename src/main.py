@@ -1,15 +1,16 @@
 #!/usr/bin/env python
 
+import sys
+
 import click
 import daiquiri
 
 from src import __logger_name__, __version__
-from src.config_template.main import main as create_config_main
-from src.create_input.main import main as create_input_main
 from src.create_input.schemas.globals import METRIC2READER as VALID_METRICS
-from src.globals import setup_logging_decorator, startup_message
-from src.plot.coefplot.main import main as coefplot_main
-from src.regressions.main import main as regressions_main
+from src.globals import HEATMAP_ORDERS, setup_logging_decorator, startup_message
+
+# the modules of each command (and their pandas, statsmodels and matplotlib
+# imports) are only loaded when the command runs, so the CLI starts fast
 
 logger = daiquiri.getLogger(__logger_name__)
 
@@ -19,7 +20,13 @@ logger = daiquiri.getLogger(__logger_name__)
 @click.option(
     "-v", "--verbose", is_flag=True, default=False, help="Enable verbose output (sets logging level to DEBUG)."
 )
-def bbgregressions(verbose):
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Time the stages and model fits and write a run report (JSON) next to the log files.",
+)
+def bbgregressions(verbose, profile):
     """bbgregressions: software for customized regression models"""
     pass
 
@@ -40,6 +47,8 @@ def bbgregressions(verbose):
 @setup_logging_decorator
 def create_config_template(metrics):
     """Config template to run regressions"""
+    from src.config_template.main import main as create_config_main
+
     startup_message(__version__, "Pre-analysis: create template for config\n")
     for metric in metrics:
         if metric not in VALID_METRICS.keys():
@@ -54,26 +63,83 @@ def create_config_template(metrics):
     name="create_input", context_settings=dict(help_option_names=["-h", "--help"]), help="Build input tables"
 )
 @click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
 @setup_logging_decorator
-def create_input(config_file):
+def create_input(config_file, jobs, force):
     """Build formatted input tables to run regressions"""
+    from src.create_input.main import main as create_input_main
+
     startup_message(__version__, "Module 1: input generation from metrics\n")
     logger.info(f"Reading user defined settings from {config_file}")
 
-    create_input_main(config_file)
+    create_input_main(config_file, force, jobs)
 
 
 @bbgregressions.command(
     name="regressions", context_settings=dict(help_option_names=["-h", "--help"]), help="Run regression models"
 )
 @click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option(
+    "--resume", is_flag=True, default=False, help="Skip the fits checkpointed by a previous interrupted run"
+)
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
+@click.option(
+    "--shard",
+    default=None,
+    callback=lambda ctx, param, value: parse_shard(value),
+    help="Run only shard i of N (i/N) of the elements of every input file, to be merged with bbgregressions merge",
+)
 @setup_logging_decorator
-def regressions(config_file):
+def regressions(config_file, jobs, resume, force, shard):
     """Run regression models"""
+    from src.regressions.main import main as regressions_main
+
     startup_message(__version__, "Module 2: run regression models\n")
 
     logger.info(f"Reading user defined settings from {config_file}")
-    regressions_main(config_file)
+    regressions_main(config_file, jobs, resume, force, shard=shard)
+
+
+def parse_shard(value):
+    """
+    (i, N) of a --shard i/N value
+    """
+    if value is None:
+        return None
+    try:
+        shard = tuple(int(x) for x in value.split("/"))
+    except ValueError:
+        shard = ()
+    if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+        raise click.BadParameter(f"{value} is not i/N, with 1 <= i <= N")
+    return shard
+
+
+@bbgregressions.command(
+    name="merge",
+    context_settings=dict(help_option_names=["-h", "--help"]),
+    help="Merge the shards of a sharded regressions run",
+)
+@click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option("--resume", is_flag=True, default=False, help="Resume the multivariate models of an interrupted merge")
+@setup_logging_decorator
+def merge(config_file, jobs, resume):
+    """Merge the shards of a sharded regressions run"""
+    from src.regressions.merge import main as merge_main
+
+    startup_message(__version__, "Module 2: merge regression models shards\n")
+
+    logger.info(f"Reading user defined settings from {config_file}")
+    merge_main(config_file, jobs, resume)
 
 
 @bbgregressions.group(
@@ -87,11 +153,113 @@ def plot():
 
 @plot.command(name="coefplot", context_settings=dict(help_option_names=["-h", "--help"]), help="Coefficients plot")
 @click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
 @setup_logging_decorator
-def coefplot(config_file):
+def coefplot(config_file, jobs, force):
+    from src.plot.coefplot.main import main as coefplot_main
+
     startup_message(__version__, "Module 3: plot regression results - coefficients\n")
     logger.info(f"Reading user defined settings from {config_file}")
-    coefplot_main(config_file)
+    coefplot_main(config_file, force, jobs)
+
+
+@plot.command(
+    name="heatmap",
+    context_settings=dict(help_option_names=["-h", "--help"]),
+    help="Coefficients heatmap of all elements, for many elements",
+)
+@click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option(
+    "--order",
+    type=click.Choice(HEATMAP_ORDERS),
+    default="clustered",
+    show_default=True,
+    help="Order of the elements: clustered by their coefficients or as in the results",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Most significant elements to zoom into, on labelled pages after the overview",
+)
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
+@setup_logging_decorator
+def heatmap(config_file, order, top, jobs, force):
+    from src.plot.heatmap.main import main as heatmap_main
+
+    startup_message(__version__, "Module 3: plot regression results - heatmap\n")
+    logger.info(f"Reading user defined settings from {config_file}")
+    heatmap_main(config_file, force, jobs, top, order)
+
+
+@bbgregressions.group(
+    name="results",
+    context_settings=dict(help_option_names=["-h", "--help"]),
+    help="Results store (SQLite) of a run",
+)
+@setup_logging_decorator
+def results():
+    """Results store of a run"""
+    pass
+
+
+@results.command(
+    name="build",
+    context_settings=dict(help_option_names=["-h", "--help"]),
+    help="Add the results of a run to its results store, from the result tables",
+)
+@click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
+@setup_logging_decorator
+def build(config_file, force):
+    from src.plot.utils import results_dirs
+    from src.regressions.store import build_store, results_keys, store_file
+    from src.utils.io import read_config
+
+    startup_message(__version__, "Results store\n")
+    output_dir = read_config(config_file)["general"]["output_dir"]
+    store = store_file(output_dir)
+    mode_dirs = [mode_dir for *_, mode_dir in results_dirs(output_dir)]
+    added = build_store(store, mode_dirs, results_keys(output_dir), force)
+    logger.info(f"{added} results added to {store}")
+
+
+@results.command(
+    name="query",
+    context_settings=dict(help_option_names=["-h", "--help"]),
+    help="Look up results in the results store (tab-separated output)",
+)
+@click.option("-config", "--config_file", type=click.Path(exists=True), help="YAML file with config settings")
+@click.option("--model", multiple=True, help="Model (repeat for several)")
+@click.option("--metric", multiple=True, help="Metric, as named in the regressions directory (repeat for several)")
+@click.option("--mode", type=click.Choice(["univariate", "multivariate"]), multiple=True, help="Mode")
+@click.option("-e", "--element", multiple=True, help="Element (repeat for several)")
+@click.option("-p", "--predictor", multiple=True, help="Predictor (repeat for several)")
+@click.option(
+    "--significant", is_flag=True, default=False, help="Only results below the significance_threshold of the config"
+)
+@click.option("-o", "--output", type=click.Path(), default=None, help="Output file [default: standard output]")
+@setup_logging_decorator
+def query(config_file, model, metric, mode, element, predictor, significant, output):
+    from src.regressions.store import query as query_store
+    from src.regressions.store import store_file
+    from src.utils.io import read_config
+
+    config = read_config(config_file)["general"]
+    filters = {"model": model, "metric": metric, "mode": mode, "elements": element, "predictors": predictor}
+    data = query_store(
+        store_file(config["output_dir"]),
+        max_sign=config["significance_threshold"] if significant else None,
+        **{key: values or None for key, values in filters.items()},
+    )
+    data.to_csv(output or sys.stdout, sep="\t", index=False)
 
 
 @bbgregressions.command(
@@ -105,31 +273,64 @@ def coefplot(config_file):
     type=click.Path(exists=True),
     help="YAML file with config settings for the entire pipeline",
 )
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True, help="Number of parallel processes"
+)
+@click.option(
+    "--resume", is_flag=True, default=False, help="Skip the fits checkpointed by a previous interrupted run"
+)
+@click.option("--force", is_flag=True, default=False, help="Redo everything, even if up to date")
+@click.option(
+    "--in-memory",
+    is_flag=True,
+    default=False,
+    help="Pass tables and results between stages in memory, writing them in the background",
+)
 @setup_logging_decorator
-def minipipeline(config_file):
+def minipipeline(config_file, jobs, resume, force, in_memory):
     """
     Executes the full pipeline:
     1. Builds input tables (create_input)
     2. Runs regression models (regressions)
     3. Plots the coefficients (coefplot)
     """
+    from src.utils.io import read_yaml
+    from src.utils.writer import BackgroundWriter
+
     startup_message(__version__, "Full Pipeline: input, regressions, and plot\n")
     logger.info(f"Starting full pipeline using settings from {config_file}")
+    config = read_yaml(config_file)
+    if in_memory:
+        # stages hand their tables and results to the next one (by file path)
+        # while a background writer saves them
+        memory = {}
+        with BackgroundWriter() as writer:
+            run_pipeline(config, jobs, resume, force, memory, writer)
+            logger.info("--- Waiting for the remaining tables and results to be written ---")
+    else:
+        run_pipeline(config, jobs, resume, force)
+    logger.info("--- Full pipeline finished successfully ---")
+
+
+def run_pipeline(config, jobs, resume, force, memory=None, writer=None):
+    """Runs the three stages of the minipipeline"""
+    from src.create_input.main import main as create_input_main
+    from src.plot.coefplot.main import main as coefplot_main
+    from src.regressions.main import main as regressions_main
 
     # 1. Run create_input
     logger.info("--- Starting create_input (Module 1) ---")
-    create_input_main(config_file)
+    create_input_main(config, force, jobs, memory, writer)
     logger.info("--- create_input finished successfully ---")
 
     # 2. Run regressions
     logger.info("--- Starting regressions (Module 2) ---")
-    regressions_main(config_file)
+    regressions_main(config, jobs, resume, force, memory, writer)
     logger.info("--- regressions finished successfully ---")
 
     # 3. Run coefplot
     logger.info("--- Starting coefplot (Module 3) ---")
-    coefplot_main(config_file)
-    logger.info("--- Full pipeline finished successfully ---")
+    coefplot_main(config, force, jobs, memory, writer)
 
 
 if __name__ == "__main__":
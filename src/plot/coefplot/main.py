@@ -6,89 +6,129 @@ from matplotlib.backends.backend_pdf import PdfPages
 from src import __logger_name__
 from src.globals import DEFAULT_CONFIG_PLOT
 from src.plot.plots import coefplot
-from src.plot.utils import add_customs, grid_dims, regressions_reader, transposer
-from src.utils.io import read_yaml
+from src.plot.utils import (grid_dims, load_results, mode_sources, plot_config, record_plots, results_dirs,
+                            transposer)
+from src.regressions.store import is_stored, results_keys, store_file, stored_modes
+from src.utils.cache import fingerprint, is_fresh, load_cache, record, save_cache
+from src.utils.io import read_config
+from src.utils.parallel import parallel_map
+from src.utils.profiling import profiled
 
 logger = daiquiri.getLogger(__logger_name__)
 
 
-def main(config_file: str) -> None:
-    """ """
+@profiled
+def main(config_file, force: bool = False, jobs: int = 1, memory: dict = None, writer=None) -> None:
+    """
+    Makes one coefficients pdf per model, metric and mode. Plots
+    whose results and plot settings did not change are skipped,
+    unless force is set. With jobs > 1 the pdfs are rendered in
+    parallel processes, one pdf per task.
+    With a memory dict and a background writer (in-memory pipeline),
+    results kept in memory by regressions are plotted from memory
+    and recorded in the cache by the writer, once written.
+    With results_store set, results are read from the store.
+    """
 
-    config = read_yaml(config_file)
-    config_general = config["general"]
-    config = config["plot"]
-
-    # update plot config with general config and defaults
-    for k in DEFAULT_CONFIG_PLOT.keys():
-        config[k] = DEFAULT_CONFIG_PLOT[k]
-    config["output_dir"] = config_general["output_dir"]
-    config["sign_thres"] = config_general["significance_threshold"]
-    config["predictors"] = config_general["predictors"]
-    config = add_customs(config)
-
-    # check if regressions directory exists
-    regres_dir = os.path.join(config["output_dir"], "regressions")
-    if not os.path.isdir(regres_dir):
-        logger.critical("Regressions directory does not exist. Aborting run")
-        logger.critical("Run/re-run bbgregressions regressions")
-        raise IOError("No regressions directory")
+    config = read_config(config_file)
+    memory = {} if memory is None else memory
+    store = store_file(config["general"]["output_dir"]) if config["general"].get("results_store") else None
+    config = plot_config(config, DEFAULT_CONFIG_PLOT)
+    dirs = results_dirs(config["output_dir"])
+    modes = stored_modes(store, results_keys(config["output_dir"])) if store else set()
 
     output_dir = os.path.join(config["output_dir"], "plot")
     os.makedirs(output_dir, exist_ok=True)
     logger.info(f"Plots will be stored in {output_dir}")
 
-    # make plots per model, per metric, per mode
-    models = os.listdir(regres_dir)
-    for model in models:
-        logger.info(f"Plots for {model}")
-        model_dir = os.path.join(regres_dir, model)
-        metrics = os.listdir(model_dir)
-        for metric in metrics:
-            logger.info(f"Making plots for {metric}...")
-            metric_dir = os.path.join(model_dir, metric)
-            modes = os.listdir(metric_dir)
-            for mode in modes:
-                logger.info(f"{mode} regressions exist. Creating pdf with plots.")
-                pdf_file = os.path.join(output_dir, model, metric, mode, f"{metric}.{mode}.pdf")
-                os.makedirs(os.path.dirname(pdf_file), exist_ok=True)
-                logger.info(f"pdf will be stored as {pdf_file}")
-                with PdfPages(pdf_file) as pdf:
-                    # load regression results
-                    mode_dir = os.path.join(metric_dir, mode)
-                    regressions_res = regressions_reader(mode_dir)
-                    elements = regressions_res["coeff"].index.tolist()
-                    predictors = regressions_res["coeff"].columns.tolist()
-
-                    # configure plot
-                    config["main_title"] = "\n".join([model, metric, mode])
-
-                    # plot with elements as main, then with predictors as main
-                    for display in ["elem_main", "pred_main"]:
-                        if display == "elem_main":
-                            main_vars = elements
-                            coeff_vars = predictors
-                            coeff_vars.reverse()
-                            config["colors"] = config["predictors_colors"]
-                            config["names"] = config["predictors_names"]
-                            config["titles"] = {elem: elem for elem in elements}
-                        elif display == "pred_main":
-                            regressions_res = transposer(regressions_res)
-                            main_vars = predictors
-                            coeff_vars = elements
-                            config["colors"] = {elem: "#C4BCB7" for elem in elements}
-                            config["names"] = {elem: elem for elem in elements}
-                            config["titles"] = config["predictors_names"]
-
-                        # configure plot grid
-                        config = grid_dims(config, main_vars, coeff_vars)
-
-                        # make plots
-                        n0 = 0
-                        n1 = config["subplots_per_page"]
-                        for page in range(config["pdf_pages"]):
-                            coefplot(regressions_res, config, main_vars[n0:n1], coeff_vars, pdf)
-                            n0 = n1
-                            n1 += config["subplots_per_page"]
+    cache = load_cache(config["output_dir"], "coefplot")
+    settings = dict(config)
+    tasks = []
+    keys = {}
+
+    # plots per model, per metric, per mode
+    for model, metric, mode, mode_dir in dirs:
+        logger.info(f"Making plots for {model} {metric}...")
+        pdf_file = os.path.join(output_dir, model, metric, mode, f"{metric}.{mode}.pdf")
+        if mode_dir not in memory:
+            key = fingerprint(mode_sources(mode_dir), settings, cache)
+            if not force and is_fresh(cache, pdf_file, key):
+                logger.info(f"{mode} plots are up to date. Skipping (use --force to redo)")
+                continue
+            keys[pdf_file] = key
+
+        logger.info(f"{mode} regressions exist. Creating pdf with plots.")
+        title = "\n".join([model, metric, mode])
+        tasks.append((pdf_file, mode_dir, title, config, memory.get(mode_dir),
+                    store if is_stored(modes, mode_dir) else None))
+
+    # make the plots
+    if jobs > 1 and len(tasks) > 1:
+        logger.info(f"Rendering {len(tasks)} pdfs in {min(jobs, len(tasks))} parallel processes")
+    parallel_map(render_pdf, tasks, jobs)
+
+    plotted = []
+    for pdf_file, mode_dir, *_ in tasks:
+        if pdf_file in keys:
+            record(cache, pdf_file, keys[pdf_file], [pdf_file])
+        else:
+            plotted.append((pdf_file, mode_dir))
+    if keys:
+        save_cache(config["output_dir"], "coefplot", cache)
+    if plotted:
+        writer.submit(record_plots, cache, plotted, settings, config["output_dir"], "coefplot")
 
     return None
+
+
+def render_pdf(pdf_file: str, mode_dir: str, title: str, config: dict, results=None, store: str = None) -> str:
+    """
+    Makes the pdf of one model, metric and mode: coefficients with
+    elements as main, then with predictors as main. Results are
+    read from mode_dir, unless given (kept in memory) or in the
+    results store.
+    """
+    config = dict(config)
+    os.makedirs(os.path.dirname(pdf_file), exist_ok=True)
+    logger.info(f"pdf will be stored as {pdf_file}")
+
+    # without creation date, the same results give the same pdf
+    with PdfPages(pdf_file, metadata={"CreationDate": None}) as pdf:
+        # load regression results
+        regressions_res = load_results(mode_dir, results, store)
+        elements = regressions_res["coeff"].index.tolist()
+        predictors = regressions_res["coeff"].columns.tolist()
+
+        # configure plot
+        config["main_title"] = title
+
+        # plot with elements as main, then with predictors as main
+        for display in ["elem_main", "pred_main"]:
+            if display == "elem_main":
+                main_vars = elements
+                coeff_vars = predictors
+                coeff_vars.reverse()
+                config["colors"] = config["predictors_colors"]
+                config["names"] = config["predictors_names"]
+                config["titles"] = {elem: elem for elem in elements}
+            elif display == "pred_main":
+                regressions_res = transposer(regressions_res)
+                main_vars = predictors
+                coeff_vars = elements
+                config["colors"] = {elem: "#C4BCB7" for elem in elements}
+                config["names"] = {elem: elem for elem in elements}
+                config["titles"] = config["predictors_names"]
+
+            # configure plot grid
+            config = grid_dims(config, main_vars, coeff_vars)
+
+            # make plots
+            n0 = 0
+            n1 = config["subplots_per_page"]
+            for page in range(config["pdf_pages"]):
+                coefplot(regressions_res, config, main_vars[n0:n1], coeff_vars, pdf)
+                n0 = n1
+                n1 += config["subplots_per_page"]
+
+    return pdf_file
+
@@ -0,0 +1,112 @@
+import os
+
+import daiquiri
+import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+
+from src import __logger_name__
+from src.globals import DEFAULT_CONFIG_HEATMAP
+from src.plot.plots import heatmap
+from src.plot.utils import (cluster_order, color_limit, has_results, load_results, mode_sources, plot_config,
+                            results_dirs, top_rows)
+from src.regressions.store import is_stored, results_keys, store_file, stored_modes
+from src.utils.cache import fingerprint, is_fresh, load_cache, record, save_cache
+from src.utils.io import read_config
+from src.utils.parallel import parallel_map
+from src.utils.profiling import profiled
+
+logger = daiquiri.getLogger(__logger_name__)
+
+
+@profiled
+def main(config_file, force: bool = False, jobs: int = 1, top: int = 0, order: str = "clustered") -> None:
+    """
+    Makes one heatmap pdf per model, metric and mode: the
+    coefficients of all elements on one page, then the top
+    elements (most significant) on zoom pages. Plots whose results
+    and plot settings did not change are skipped, unless force is
+    set. With jobs > 1 the pdfs are rendered in parallel processes.
+    With results_store set, results are read from the store.
+    """
+
+    config = read_config(config_file)
+    store = store_file(config["general"]["output_dir"]) if config["general"].get("results_store") else None
+    config = plot_config(config, DEFAULT_CONFIG_HEATMAP)
+    config["top"] = top
+    config["order"] = order
+    dirs = results_dirs(config["output_dir"])
+    modes = stored_modes(store, results_keys(config["output_dir"])) if store else set()
+
+    output_dir = os.path.join(config["output_dir"], "plot")
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Heatmaps will be stored in {output_dir}")
+
+    cache = load_cache(config["output_dir"], "heatmap")
+    settings = dict(config)
+    tasks = []
+    keys = {}
+
+    # heatmaps per model, per metric, per mode
+    for model, metric, mode, mode_dir in dirs:
+        if not has_results(mode_dir):
+            logger.warning(f"No results in {mode_dir}. Skipping {model} {metric} {mode} heatmap")
+            continue
+        pdf_file = os.path.join(output_dir, model, metric, mode, f"{metric}.{mode}.heatmap.pdf")
+        key = fingerprint(mode_sources(mode_dir), settings, cache)
+        if not force and is_fresh(cache, pdf_file, key):
+            logger.info(f"{model} {metric} {mode} heatmap is up to date. Skipping (use --force to redo)")
+            continue
+        keys[pdf_file] = key
+        tasks.append((pdf_file, mode_dir, "\n".join([model, metric, mode]), config,
+                    store if is_stored(modes, mode_dir) else None))
+
+    # make the plots
+    if jobs > 1 and len(tasks) > 1:
+        logger.info(f"Rendering {len(tasks)} pdfs in {min(jobs, len(tasks))} parallel processes")
+    parallel_map(render_pdf, tasks, jobs)
+
+    for pdf_file, *_ in tasks:
+        record(cache, pdf_file, keys[pdf_file], [pdf_file])
+    if tasks:
+        save_cache(config["output_dir"], "heatmap", cache)
+
+    return None
+
+
+def render_pdf(pdf_file: str, mode_dir: str, title: str, config: dict, store: str = None) -> str:
+    """
+    Makes the heatmap pdf of one model, metric and mode (results
+    from the store if given). Elements are ordered as
+    config["order"] says, zoom pages keep that order.
+    """
+    results = load_results(mode_dir, store=store)
+    coeff = results["coeff"]
+    elements = coeff.index.tolist()
+    predictors = coeff.columns.tolist()
+    values = coeff.to_numpy(dtype=float)
+    sign = results["sign"].reindex(index=elements, columns=predictors).to_numpy(dtype=float)
+
+    if config["order"] == "clustered":
+        rows = cluster_order(values, config["heatmap_cluster_max"], config["heatmap_centroids"])
+        elements = [elements[i] for i in rows]
+        values, sign = values[rows], sign[rows]
+    significant = sign < config["sign_thres"]
+    # same color scale on all pages
+    config = dict(config, color_limit=color_limit(values))
+
+    os.makedirs(os.path.dirname(pdf_file), exist_ok=True)
+    logger.info(f"pdf will be stored as {pdf_file}")
+    # without creation date, the same results give the same pdf
+    with PdfPages(pdf_file, metadata={"CreationDate": None}) as pdf:
+        heatmap(values, significant, config, elements, predictors, title, pdf)
+
+        # zoom pages of the top elements
+        top = top_rows(sign, values, config["top"]) if config["top"] else np.array([], dtype=int)
+        per_page = config["heatmap_rows_per_page"]
+        n_pages = -(-len(top) // per_page)
+        for page in range(n_pages):
+            rows = top[page * per_page:(page + 1) * per_page]
+            heatmap(values[rows], significant[rows], config, [elements[i] for i in rows], predictors,
+                    f"{title}\nTop {len(top)} elements ({page + 1}/{n_pages})", pdf)
+
+    return pdf_file
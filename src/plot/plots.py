@@ -1,5 +1,14 @@
+import matplotlib
+# plots are only written to pdf files, also from worker processes
+matplotlib.use("Agg")
+import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.cm import ScalarMappable
 
+from src.utils.profiling import profiled
+
+@profiled
 def coefplot(results: dict,
             config: dict,
             main_vars: list,
@@ -14,25 +23,23 @@ def coefplot(results: dict,
                         sharey = True)
     plt.suptitle(config["main_title"], fontsize = 14)
 
-    for main_var, ax in zip(main_vars, axs.flat):
+    # values of the page (main vars x coeff vars), sliced once
+    values = {res: results[res].reindex(index = main_vars, columns = coeff_vars).to_numpy(dtype = float)
+            for res in ["coeff", "low_ci", "high_ci", "sign"]}
+    colors = [config["colors"][coeff_var] for coeff_var in coeff_vars]
+    y = np.arange(len(coeff_vars))
 
-        for i, coeff_var in enumerate(coeff_vars):
+    for j, (main_var, ax) in enumerate(zip(main_vars, axs.flat)):
 
-            # check whether the coeff is significant to highlight the point in black
-            if results["sign"].loc[main_var][coeff_var] < config["sign_thres"]:
-                edgecolors = "black"
-            else:
-                edgecolors = "face"
+        # significant coeffs are highlighted with a black edge
+        significant = values["sign"][j] < config["sign_thres"]
+        edgecolors = ["black" if sign else color for sign, color in zip(significant, colors)]
 
-            # plot dot + confidence interval
-            ax.scatter(results["coeff"].loc[main_var][coeff_var], i, 
-                    color = config["colors"][coeff_var],
-                    s = config["coeffdot_size"], edgecolors = edgecolors, 
-                    linewidths = config["coeffdot_linewidth"])
-            ax.hlines(i, 
-                    results["low_ci"].loc[main_var][coeff_var],
-                    results["high_ci"].loc[main_var][coeff_var],
-                    color = config["colors"][coeff_var])
+        # plot dots + confidence intervals
+        ax.scatter(values["coeff"][j], y, c = colors,
+                s = config["coeffdot_size"], edgecolors = edgecolors,
+                linewidths = config["coeffdot_linewidth"])
+        ax.hlines(y, values["low_ci"][j], values["high_ci"][j], colors = colors)
 
         # add labels
         y_ticks = [i for i in range(len(coeff_vars))]
@@ -51,4 +58,48 @@ def coefplot(results: dict,
 
     plt.tight_layout()
     pdf.savefig()  # saves the current figure into a pdf page
-    plt.close() 
\ No newline at end of file
+    plt.close() 
+
+@profiled
+def heatmap(coeff: np.ndarray,
+            significant: np.ndarray,
+            config: dict,
+            rows: list,
+            cols: list,
+            title: str,
+            pdf) -> None:
+    """
+    One page with the coefficients of rows x cols as a single
+    rasterized image, so its size does not grow with the rows.
+    Non-significant cells are faded, missing ones are grey.
+    """
+
+    fig, ax = plt.subplots(figsize = (config["heatmap_width"], config["heatmap_height"]))
+
+    # cell colors, non-significant ones blended with white
+    norm = mcolors.Normalize(-config["color_limit"], config["color_limit"])
+    cmap = plt.get_cmap(config["heatmap_cmap"]).with_extremes(bad = "#BDBDBD")
+    colors = cmap(norm(coeff))
+    faded = ~significant
+    colors[faded, :3] = 1 - config["heatmap_faded"] * (1 - colors[faded, :3])
+
+    # few rows are drawn cell by cell and labelled, many are averaged into pixels
+    labelled = len(rows) <= config["heatmap_max_labels"]
+    ax.imshow(colors, aspect = "auto", interpolation = "nearest" if labelled else "antialiased",
+            interpolation_stage = "rgba")
+
+    # add labels
+    ax.set_xticks(range(len(cols)), [config["predictors_names"].get(col, col) for col in cols],
+                rotation = 45, ha = "right")
+    if labelled:
+        ax.set_yticks(range(len(rows)), rows, fontsize = "small")
+    else:
+        ax.set_yticks([])
+        ax.set_ylabel(f"{len(rows)} elements")
+    ax.set_xlabel(f"Faded: not significant (>= {config['sign_thres']})")
+    fig.colorbar(ScalarMappable(norm, cmap), ax = ax, label = "Effect size", shrink = 0.4)
+    ax.set_title(title)
+
+    plt.tight_layout()
+    pdf.savefig(dpi = config["heatmap_dpi"])
+    plt.close()
@@ -1,12 +1,93 @@
 import os
+import warnings
+
+import daiquiri
+import numpy as np
 import pandas as pd
 import seaborn as sns
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.cluster.vq import kmeans2, vq
+
+from src import __logger_name__
+from src.regressions.store import mode_key, mode_sources, results_frames
+from src.regressions.utils import RES_ELEMENTS
+from src.utils.cache import fingerprint, record, save_cache
+from src.utils.profiling import profiled
+
+logger = daiquiri.getLogger(__logger_name__)
+
+def plot_config(config: dict, defaults: dict) -> dict:
+    """
+    Plot section of config, updated with the general config and
+    the defaults of the plot type
+    """
+    config_general = config["general"]
+    config = config["plot"]
+    for k in defaults.keys():
+        config.setdefault(k, defaults[k])
+    config["output_dir"] = config_general["output_dir"]
+    config["sign_thres"] = config_general["significance_threshold"]
+    config["predictors"] = config_general["predictors"]
+
+    return add_customs(config)
+
+def results_dirs(output_dir: str) -> list:
+    """
+    (model, metric, mode, directory) of every regressions result
+    """
+    # check if regressions directory exists
+    regres_dir = os.path.join(output_dir, "regressions")
+    if not os.path.isdir(regres_dir):
+        logger.critical("Regressions directory does not exist. Aborting run")
+        logger.critical("Run/re-run bbgregressions regressions")
+        raise IOError("No regressions directory")
 
+    # only directories (e.g. not checkpoints of interrupted runs)
+    dirs = []
+    for model in os.listdir(regres_dir):
+        model_dir = os.path.join(regres_dir, model)
+        if not os.path.isdir(model_dir):
+            continue
+        for metric in os.listdir(model_dir):
+            metric_dir = os.path.join(model_dir, metric)
+            if not os.path.isdir(metric_dir):
+                continue
+            for mode in os.listdir(metric_dir):
+                if os.path.isdir(os.path.join(metric_dir, mode)):
+                    dirs.append((model, metric, mode, os.path.join(metric_dir, mode)))
+
+    return dirs
+
+def has_results(mode_dir: str) -> bool:
+    """
+    Whether some element has results in mode_dir (the result
+    tables only keep elements with results)
+    """
+    file = os.path.join(mode_dir, "coeff.tsv")
+    if not os.path.exists(file):
+        return False
+    with open(file) as fh:
+        fh.readline()
+        return bool(fh.readline().strip())
+
+def record_plots(cache: dict, plotted: list, settings: dict, output_dir: str, stage: str) -> None:
+    """
+    Stores the fingerprints of the plots made from results kept
+    in memory (pdf file and results directory), once the results
+    are written, and saves the cache of stage.
+    """
+    for pdf_file, mode_dir in plotted:
+        record(cache, pdf_file, fingerprint(mode_sources(mode_dir), settings, cache), [pdf_file])
+    save_cache(output_dir, stage, cache)
+
+@profiled
 def regressions_reader(directory: str) -> dict:
     """
     """
     results = {}
-    files = os.listdir(directory)
+    # only model results (e.g. not diagnostics.tsv)
+    files = [file for file in os.listdir(directory)
+            if file.split(".")[0] in RES_ELEMENTS + ["qval"]]
     # do not load pvals if qvals were calculated
     if "qval.tsv" in files:
         files.remove("pval.tsv")
@@ -21,6 +102,33 @@ def regressions_reader(directory: str) -> dict:
 
     return results
 
+def regressions_frames(results) -> dict:
+    """
+    Same as regressions_reader, from results kept in memory
+    """
+    results_f = {}
+    for res_elem in RES_ELEMENTS + ["qval"]:
+        # do not use pvals if qvals were calculated
+        if res_elem not in results or (res_elem == "pval" and "qval" in results):
+            continue
+        name = "sign" if res_elem in ["qval", "pval"] else res_elem
+        results_f[name] = results.to_frame(res_elem).dropna(axis = 0, how = "all")
+
+    return results_f
+
+def load_results(mode_dir: str, results = None, store: str = None) -> dict:
+    """
+    Results of one mode as regressions_reader returns them: from
+    the results kept in memory if given, else from the results
+    store if given, else from the result files in mode_dir
+    """
+    if results is not None:
+        return regressions_frames(results)
+    if store is not None:
+        return results_frames(store, *mode_key(mode_dir))
+
+    return regressions_reader(mode_dir)
+
 def transposer(results: dict) -> dict:
     """
     """
@@ -57,6 +165,57 @@ def grid_dims(config: dict,
 
     return config
 
+@profiled
+def cluster_order(values: np.ndarray, max_size: int, n_centroids: int, chunk_size: int = 10000) -> np.ndarray:
+    """
+    Order of the rows of values (NAs as 0) that places similar rows
+    together: leaves of their hierarchical clustering (average
+    linkage). Above max_size rows, n_centroids k-means centroids
+    (fitted on a sample of the rows) are clustered instead and the
+    rows of each centroid are ordered by their mean, so time and
+    memory stay bounded
+    """
+    values = np.nan_to_num(values)
+    if len(values) < 3:
+        return np.arange(len(values))
+    if len(values) <= max_size:
+        return leaves_list(linkage(values, method = "average"))
+
+    rng = np.random.default_rng(0)
+    sample = values[np.sort(rng.choice(len(values), min(len(values), 10 * n_centroids), replace = False))]
+    with warnings.catch_warnings():
+        # some centroids may end up without rows
+        warnings.simplefilter("ignore")
+        centroids, _ = kmeans2(sample, n_centroids, minit = "points", seed = 0)
+    # nearest centroid of every row, by chunks (distances are rows x centroids)
+    labels = np.concatenate([vq(values[i:i + chunk_size], centroids)[0]
+                            for i in range(0, len(values), chunk_size)])
+    rank = np.empty(n_centroids, dtype = int)
+    rank[leaves_list(linkage(centroids, method = "average"))] = np.arange(n_centroids)
+
+    return np.lexsort((values.mean(axis = 1), rank[labels]))
+
+def top_rows(sign: np.ndarray, coeff: np.ndarray, n: int) -> np.ndarray:
+    """
+    Positions of the n rows with the most significant coefficients
+    (lowest p/q-value, then largest absolute coefficient), in their
+    original order
+    """
+    best = np.where(np.isnan(sign), np.inf, sign).min(axis = 1)
+    effect = np.abs(np.nan_to_num(coeff)).max(axis = 1)
+
+    return np.sort(np.lexsort((-effect, best))[:n])
+
+def color_limit(values: np.ndarray) -> float:
+    """
+    Limit of a color scale centered at 0 (99th percentile of the
+    absolute values, so outliers do not wash out the rest)
+    """
+    values = np.abs(values[np.isfinite(values)])
+    limit = np.percentile(values, 99) if len(values) else 0
+
+    return limit if limit > 0 else 1.0
+
 def add_customs(config: dict) -> dict:
     """
     """
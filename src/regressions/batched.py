@@ -0,0 +1,280 @@
+import numpy as np
+from scipy import stats
+
+FIT_STATS = ["params", "bse", "pvalues", "low_ci", "high_ci"]
+# smallest group of columns with the same missing rows worth its own factorization
+MIN_PATTERN_SIZE = 2
+# golden section steps refining the variance ratio of mixed models
+GOLDEN_ITERATIONS = 60
+
+
+def ols(X: np.ndarray, Y: np.ndarray, alpha: float = 0.05) -> dict:
+    """
+    Fits one ordinary least squares model per column of Y,
+    all sharing the design matrix X, in a single batch.
+
+    Rows with a missing value in X or in a given column of Y
+    are dropped for that column only, which reproduces
+    statsmodels' missing="drop" fit by fit. Columns are grouped
+    by missingness pattern: columns observed on every usable row
+    (fast path) and columns sharing the same missing rows are
+    solved with a single factorization of X per pattern. The
+    remaining columns go through one per-column masked batch.
+
+    Parameters
+    ----------
+    X: np.ndarray
+        design matrix (samples x terms)
+    Y: np.ndarray
+        responses (samples x elements)
+    alpha: float
+        significance level of the confidence intervals
+
+    Returns
+    -------
+    dict
+        params, bse, pvalues, low_ci and high_ci arrays
+        (elements x terms)
+    """
+
+    valid = ~np.isnan(X).any(axis=1)
+    mask = ~np.isnan(Y) & valid[:, None]
+    complete = (mask == valid[:, None]).all(axis=0)
+
+    res = {stat: np.full((Y.shape[1], X.shape[1]), np.nan) for stat in FIT_STATS}
+    if complete.any():
+        fill_batch(res, np.flatnonzero(complete), ols_shared(X[valid], Y[valid][:, complete], alpha))
+
+    incomplete = np.flatnonzero(~complete)
+    if len(incomplete):
+        # one opaque bytes key per column, so patterns are compared as scalars
+        patterns = np.ascontiguousarray(np.packbits(mask[:, incomplete], axis=0).T)
+        patterns = patterns.view(np.dtype((np.void, patterns.shape[1]))).ravel()
+        _, labels, counts = np.unique(patterns, return_inverse=True, return_counts=True)
+        shared = counts[labels] >= MIN_PATTERN_SIZE
+        for label in np.unique(labels[shared]):
+            cols = incomplete[labels == label]
+            rows = mask[:, cols[0]]
+            fill_batch(res, cols, ols_shared(X[rows], Y[rows][:, cols], alpha))
+        singles = incomplete[~shared]
+        if len(singles):
+            fill_batch(res, singles, ols_masked(X, Y[:, singles], alpha))
+
+    return res
+
+
+def fill_batch(res: dict, cols: np.ndarray, batch_res: dict) -> None:
+    """ """
+    for stat in FIT_STATS:
+        res[stat][cols] = batch_res[stat]
+
+
+def ols_shared(X: np.ndarray, Y: np.ndarray, alpha: float = 0.05) -> dict:
+    """
+    Fits all the columns of Y (no missing values) against X
+    as a multiple right-hand side system: X is factorized once.
+    The pseudo-inverse (SVD) is the factorization statsmodels
+    uses, so rank-deficient designs get the same solution.
+    """
+
+    X_pinv = np.linalg.pinv(X)
+    params = (X_pinv @ Y).T
+    ssr = ((Y - X @ params.T) ** 2).sum(axis=0)
+    df_resid = np.full(Y.shape[1], len(X) - np.linalg.matrix_rank(X), dtype=float)
+    unscaled_var = np.tile(np.diag(X_pinv @ X_pinv.T), (Y.shape[1], 1))
+
+    return fit_stats(params, unscaled_var, ssr, df_resid, alpha)
+
+
+def ols_masked(X: np.ndarray, Y: np.ndarray, alpha: float = 0.05) -> dict:
+    """
+    Fits every column of Y against X on its own set of
+    non-missing rows, through one gram matrix per column
+    """
+
+    n_terms = X.shape[1]
+    mask = ~np.isnan(Y) & ~np.isnan(X).any(axis=1)[:, None]
+    weights = mask.astype(float)
+    X0 = np.nan_to_num(X)
+    Y0 = np.where(mask, Y, 0.0)
+
+    # per-element gram matrix X'WX and X'Wy through plain matrix products
+    cross = (X0[:, :, None] * X0[:, None, :]).reshape(len(X0), -1)
+    gram = (cross.T @ weights).T.reshape(-1, n_terms, n_terms)
+    xty = Y0.T @ X0
+
+    # pinv as statsmodels does, so rank-deficient designs get the same solution
+    gram_inv = np.linalg.pinv(gram, hermitian=True)
+    params = np.einsum("eij,ej->ei", gram_inv, xty)
+
+    resid = np.where(mask, Y0 - X0 @ params.T, 0.0)
+    ssr = (resid**2).sum(axis=0)
+    df_resid = weights.sum(axis=0) - np.linalg.matrix_rank(gram, hermitian=True)
+    unscaled_var = np.diagonal(gram_inv, axis1=1, axis2=2)
+
+    return fit_stats(params, unscaled_var, ssr, df_resid, alpha)
+
+
+def fit_stats(
+    params: np.ndarray, unscaled_var: np.ndarray, ssr: np.ndarray, df_resid: np.ndarray, alpha: float
+) -> dict:
+    """
+    Standard errors, t-test p-values and confidence intervals
+    from the estimates of a batch of least squares fits
+    """
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df = np.where(df_resid > 0, df_resid, np.nan)
+        scale = ssr / df
+        bse = np.sqrt(scale[:, None] * unscaled_var)
+        tvalues = params / bse
+        pvalues = 2 * stats.t.sf(np.abs(tvalues), df[:, None])
+        q = stats.t.ppf(1 - alpha / 2, df[:, None])
+
+    return {
+        "params": params,
+        "bse": bse,
+        "pvalues": pvalues,
+        "low_ci": params - q * bse,
+        "high_ci": params + q * bse,
+    }
+
+
+def mixedlm(X: np.ndarray, Y: np.ndarray, groups: np.ndarray, alpha: float = 0.05) -> dict:
+    """
+    Fits one random intercept linear mixed model (REML) per
+    column of Y, all sharing the design matrix X and the groups
+    of the random effect, in a single batch.
+
+    The error variance and the fixed effects are profiled out,
+    so each fit reduces to maximizing the restricted likelihood
+    over the variance ratio of the random intercept. Every term
+    of that likelihood only depends on per-group sums, which are
+    computed once; all elements are then optimized together by
+    a grid search followed by golden section refinement.
+    Standard errors come from the same Hessian statsmodels uses.
+
+    Parameters
+    ----------
+    X: np.ndarray
+        design matrix (samples x terms)
+    Y: np.ndarray
+        responses (samples x elements)
+    groups: np.ndarray
+        integer group code per sample (-1 if missing)
+    alpha: float
+        significance level of the confidence intervals
+
+    Returns
+    -------
+    dict
+        params, bse, pvalues, low_ci and high_ci arrays
+        (elements x terms), ratio, the estimated variance of the
+        random intercept relative to the residual one, and failed,
+        flagging the elements that could not be fitted in the batch
+    """
+
+    n_terms = X.shape[1]
+    valid = ~np.isnan(X).any(axis=1) & (groups >= 0)
+    mask = ~np.isnan(Y) & valid[:, None]
+    weights = mask.astype(float)
+    X0 = np.where(valid[:, None], np.nan_to_num(X), 0.0)
+    Y0 = np.where(mask, Y, 0.0)
+
+    # per-group sums, the only statistics the likelihood needs
+    indicator = (groups[None, :] == np.arange(groups.max() + 1)[:, None]).astype(float)
+    n_g = indicator @ weights
+    sum_x = np.stack([indicator @ (weights * X0[:, [i]]) for i in range(n_terms)], axis=-1)
+    sum_y = indicator @ Y0
+    cross = (X0[:, :, None] * X0[:, None, :]).reshape(len(X0), -1)
+    xtx = (cross.T @ weights).T.reshape(-1, n_terms, n_terms)
+    xty = Y0.T @ X0
+    yty = (Y0**2).sum(axis=0)
+    nobs = weights.sum(axis=0)
+    df_resid = nobs - n_terms
+
+    def gls(ratio):
+        shrink = ratio / (1 + ratio * n_g)
+        xtvix = xtx - np.einsum("ge,gei,gej->eij", shrink, sum_x, sum_x)
+        xtviy = xty - np.einsum("ge,gei,ge->ei", shrink, sum_x, sum_y)
+        ytviy = yty - (shrink * sum_y**2).sum(axis=0)
+        xtvix_inv = np.linalg.pinv(xtvix, hermitian=True)
+        params = np.einsum("eij,ej->ei", xtvix_inv, xtviy)
+        qf = ytviy - (params * xtviy).sum(axis=1)
+        return xtvix, xtvix_inv, params, qf
+
+    def loglike(ratio):
+        xtvix, _, _, qf = gls(ratio)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ll = -0.5 * df_resid * np.log(qf)
+            ll -= 0.5 * np.log1p(ratio * n_g).sum(axis=0)
+            ll -= 0.5 * np.linalg.slogdet(xtvix)[1]
+        return np.where(np.isfinite(ll), ll, -np.inf)
+
+    # square root of the variance ratio: coarse grid, then golden section
+    grid = np.concatenate([[0.0], np.logspace(-3, 3, 49)])
+    grid_ll = np.stack([loglike(np.full(Y.shape[1], u**2)) for u in grid])
+    best = grid_ll.argmax(axis=0)
+    lo = grid[np.maximum(best - 1, 0)]
+    hi = grid[np.minimum(best + 1, len(grid) - 1)]
+
+    golden = (np.sqrt(5) - 1) / 2
+    u1, u2 = hi - golden * (hi - lo), lo + golden * (hi - lo)
+    ll1, ll2 = loglike(u1**2), loglike(u2**2)
+    for _ in range(GOLDEN_ITERATIONS):
+        left = ll1 > ll2
+        hi = np.where(left, u2, hi)
+        lo = np.where(left, lo, u1)
+        u_new = np.where(left, hi - golden * (hi - lo), lo + golden * (hi - lo))
+        ll_new = loglike(u_new**2)
+        u1, u2 = np.where(left, u_new, u2), np.where(left, u1, u_new)
+        ll1, ll2 = np.where(left, ll_new, ll2), np.where(left, ll1, ll_new)
+    u = (lo + hi) / 2
+    u = np.where(loglike(u**2) >= grid_ll.max(axis=0), u, grid[best])
+    ratio = u**2
+
+    # fixed effects and Hessian of the profiled likelihood at the optimum
+    xtvix, xtvix_inv, params, qf = gls(ratio)
+    factor = 1 / (1 + ratio * n_g)
+    sum_r = sum_y - np.einsum("gei,ei->ge", sum_x, params)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hess_fe = -df_resid[:, None, None] * xtvix / qf[:, None, None]
+        hess_fere = -df_resid[:, None] * np.einsum("ge,gei,ge->ei", factor**2, sum_x, sum_r) / qf[:, None]
+        B = (factor**2 * sum_r**2).sum(axis=0)
+        D = (2 * n_g * factor**3 * sum_r**2).sum(axis=0)
+        xtax = np.einsum("ge,gei,gej->eij", factor**2, sum_x, sum_x)
+        F = np.einsum("ge,gei,gej->eij", 2 * n_g * factor**3, sum_x, sum_x)
+        QL = xtvix_inv @ xtax
+        hess_re = (n_g**2 * factor**2).sum(axis=0) / 2
+        hess_re -= 0.5 * df_resid * (D / qf - B**2 / qf**2)
+        hess_re += 0.5 * (np.einsum("eij,eji->e", QL, QL) - np.einsum("eii->e", xtvix_inv @ F))
+
+    hess = np.zeros((Y.shape[1], n_terms + 1, n_terms + 1))
+    hess[:, :n_terms, :n_terms] = hess_fe
+    hess[:, :n_terms, n_terms] = hess_fere
+    hess[:, n_terms, :n_terms] = hess_fere
+    hess[:, n_terms, n_terms] = hess_re
+
+    failed = (df_resid <= 0) | (np.linalg.matrix_rank(xtx, hermitian=True) < n_terms)
+    failed |= ~np.isfinite(hess).all(axis=(1, 2))
+    hess[failed] = -np.eye(n_terms + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pcov = np.linalg.inv(-hess)
+        bse = np.sqrt(np.diagonal(pcov, axis1=1, axis2=2)[:, :n_terms])
+        failed |= ~np.isfinite(bse).all(axis=1)
+        pvalues = 2 * stats.norm.sf(np.abs(params / bse))
+    q = stats.norm.ppf(1 - alpha / 2)
+
+    res = {
+        "params": params,
+        "bse": bse,
+        "pvalues": pvalues,
+        "low_ci": params - q * bse,
+        "high_ci": params + q * bse,
+    }
+    for stat in FIT_STATS:
+        res[stat][failed] = np.nan
+    res["ratio"] = np.where(failed, np.nan, ratio)
+    res["failed"] = failed
+
+    return res
@@ -4,33 +4,61 @@ import daiquiri
 import pandas as pd
 
 from src import __logger_name__
-from src.regressions.models import main as run_model
+from src.globals import log_context
+from src.regressions.models import main as run_model, model_engine
+from src.regressions.schema import RESULTS_SETTINGS
+from src.regressions.store import (import_results, is_stored, mode_key, record_keys, results_keys, store_file,
+                                   stored_modes, write_store)
 from src.regressions.utils import (clean_input, clean_multi, init_storage,
-                                   multi_rules)
-from src.utils.io import read_yaml
+                                   multi_rules, write_results)
+from src.utils.cache import fingerprint, is_fresh, load_cache, record, save_cache
+from src.utils.io import list_tables, read_config, read_table, table_sources
+from src.utils.parallel import parallel_map
+from src.utils.profiling import profiled
 
 logger = daiquiri.getLogger(__logger_name__)
 
-def main(config_file: str) -> None:
+# results directory of each mode
+MODE_DIRS = {"uni": "univariate", "multi": "multivariate"}
+
+@profiled
+def main(config_file, jobs: int = 1, resume: bool = False, force: bool = False,
+        memory: dict = None, writer = None, shard: tuple = None) -> None:
     """
+    Runs the models for every input file. Files whose input,
+    predictors and settings did not change since their results
+    were written are skipped, unless force is set.
+    With a memory dict and a background writer (in-memory pipeline),
+    inputs kept in memory by create_input are used as they are and
+    the results are kept in memory by directory for the next stage
+    and written by the writer.
+    With shard (i, N), only the univariate models of the i-th of N
+    parts of the elements of every input file are run, to be merged
+    with those of the other shards (see regressions.merge).
     """
 
-    config = read_yaml(config_file)
+    config = read_config(config_file)
     config = config["general"]
+    memory = {} if memory is None else memory
+    model_engine(config)
 
     # use existing inputs (check)
     inputs_dir = os.path.join(config["output_dir"], "input")
-    if os.path.isdir(inputs_dir):
-        if os.listdir(inputs_dir):
-            inputs = os.listdir(inputs_dir)
-        else:
-            logger.critical("Input directory does not have files. Aborting run")
-            logger.critical("Run/re-run bbgregressions create_input")
-            raise IOError("No files in input directory")
-    else:
+    if not os.path.isdir(inputs_dir):
         logger.critical("Input directory does not exist. Aborting run")
         logger.critical("Run/re-run bbgregressions create_input")
         raise IOError("No input directory")
+
+    # tables kept in memory replace those on disk
+    kept = {os.path.basename(path): table for path, table in memory.items()
+            if os.path.dirname(path) == inputs_dir}
+    kept_stems = {os.path.splitext(file)[0] for file in kept}
+    inputs = [file for file in list_tables(inputs_dir)
+            if os.path.splitext(file)[0] not in kept_stems] + list(kept)
+    if not inputs:
+        logger.critical("Input directory does not have files. Aborting run")
+        logger.critical("Run/re-run bbgregressions create_input")
+        raise IOError("No files in input directory")
     
     logger.info(f"Model that will be run: {config['model']}")
 
@@ -45,18 +73,173 @@ def main(config_file: str) -> None:
     os.makedirs(output_dir, exist_ok = True) 
     logger.info(f"Model results will be stored in {output_dir}")
 
-    for file in inputs:
+    # skip inputs with up to date results (inputs kept in memory were just generated)
+    cache = load_cache(config["output_dir"], "regressions")
+    settings = {field: config.get(field) for field in RESULTS_SETTINGS}
+    keys = {file: input_fingerprint(os.path.join(inputs_dir, file), config, settings, cache)
+            for file in inputs if file not in kept}
+    if not force:
+        fresh = [file for file in keys if is_fresh(cache, f"{config['model']}/{file}", keys[file])]
+        for file in fresh:
+            logger.info(f"Results of {file} are up to date. Skipping (use --force to rerun)")
+        inputs = [file for file in inputs if file not in fresh]
+        if config.get("results_store"):
+            fill_store(fresh, output_dir, config)
+
+    # biggest files first, so the last ones to start are the quickest
+    inputs = sorted(inputs, key = lambda file: kept[file].size * 8 if file in kept
+                    else os.path.getsize(os.path.join(inputs_dir, file)),
+                    reverse = True)
+    file_jobs, fit_jobs = schedule(len(inputs), jobs)
+    if jobs > 1:
+        logger.info(f"Processing {file_jobs} input files at a time with {fit_jobs} processes each")
+
+    if shard is not None:
+        logger.info(f"Running shard {shard[0]} of {shard[1]}: univariate models of 1 in {shard[1]} elements")
+        tasks = [(os.path.join(inputs_dir, file), predictors_data, config, output_dir, shard, fit_jobs, resume)
+                for file in inputs]
+        shard_files = parallel_map(run_shard, tasks, file_jobs)
+        logger.info(f"{len(shard_files)} shard files written. Merge them once all shards are done "
+                    "(bbgregressions merge)")
+        return None
+
+    tasks = [(os.path.join(inputs_dir, file), predictors_data, config, output_dir, fit_jobs, resume,
+            kept.get(file), writer is not None)
+            for file in inputs]
+    outputs = parallel_map(run_metric, tasks, file_jobs)
+    if writer is None:
+        files = {file: files for file, (files, _) in zip(inputs, outputs)}
+        record_results(cache, files, keys, config, settings)
+    else:
+        results = {file: results for file, (_, results) in zip(inputs, outputs)}
+        for file in inputs:
+            metric_dir = os.path.join(output_dir, metric_name(file))
+            for mode, res in results[file].items():
+                memory[os.path.join(metric_dir, MODE_DIRS[mode])] = res
+        writer.submit(save_results, results, output_dir, cache, keys, config, settings)
+    
+    return None
+
+def metric_name(file: str) -> str:
+    """
+    """
+
+    return ".".join(os.path.basename(file).split(".")[:-1])
+
+def input_fingerprint(file: str,
+                    config: dict,
+                    settings: dict,
+                    cache: dict) -> str:
+    """
+    Fingerprint of the results of an input file
+    """
+
+    return fingerprint(table_sources(file) + [config["predictors_file"]], settings, cache)
+
+def record_results(cache: dict,
+                files: dict,
+                keys: dict,
+                config: dict,
+                settings: dict) -> None:
+    """
+    Stores the result files of each input file with its
+    fingerprint and saves the cache, and sets it for their
+    results in the results store (if any). Fingerprints not in
+    keys (inputs kept in memory) are taken from the written inputs
+    """
+
+    inputs_dir = os.path.join(config["output_dir"], "input")
+    modes = {}
+    for file, result_files in files.items():
+        key = keys.get(file) or input_fingerprint(os.path.join(inputs_dir, file), config, settings, cache)
+        record(cache, f"{config['model']}/{file}", key, result_files)
+        modes.update({mode_key(os.path.dirname(result_file)): key for result_file in result_files})
+    save_cache(config["output_dir"], "regressions", cache)
+    if config.get("results_store"):
+        record_keys(store_file(config["output_dir"]), modes)
+
+    return None
+
+def save_results(results: dict,
+                output_dir: str,
+                cache: dict,
+                keys: dict,
+                config: dict,
+                settings: dict) -> None:
+    """
+    Writes the results kept in memory (by input file and mode)
+    and records them in the cache
+    """
+
+    store = store_file(config["output_dir"]) if config.get("results_store") else None
+    files = {file: save_metric(os.path.join(output_dir, metric_name(file)), results[file], store)
+            for file in results}
+    record_results(cache, files, keys, config, settings)
+
+    return None
+
+def fill_store(files: list,
+            output_dir: str,
+            config: dict) -> None:
+    """
+    Adds the results of up to date input files missing from the
+    results store (e.g. written while the store was not enabled)
+    """
+
+    store = store_file(config["output_dir"])
+    keys = results_keys(config["output_dir"])
+    modes = stored_modes(store, keys)
+    for file in files:
+        metric_dir = os.path.join(output_dir, metric_name(file))
+        for mode in MODE_DIRS.values():
+            mode_dir = os.path.join(metric_dir, mode)
+            if os.path.isdir(mode_dir) and not is_stored(modes, mode_dir):
+                logger.info(f"Adding the results of {metric_name(file)} ({mode}) to the results store")
+                import_results(store, mode_dir, keys.get(mode_key(mode_dir)))
+
+    return None
+
+def schedule(n_files: int,
+            jobs: int) -> tuple:
+    """
+    Splits the available processes between input files run
+    at the same time and model fits within each file
+    """
+
+    file_jobs = max(1, min(n_files, jobs))
+    fit_jobs = max(1, jobs // file_jobs)
 
-        metric = ".".join(file.split(".")[:-1])
-        file = os.path.join(inputs_dir, file)
-        data = pd.read_csv(file, sep = "\t", index_col = 0)
+    return (file_jobs, fit_jobs)
+
+@profiled
+def run_metric(file: str,
+            predictors_data: pd.DataFrame,
+            config: dict,
+            output_dir: str,
+            jobs: int = 1,
+            resume: bool = False,
+            data: pd.DataFrame = None,
+            keep: bool = False) -> tuple:
+    """
+    Runs the univariate (and multivariate) models
+    for one input file, read from disk unless its data is given.
+    Fits are checkpointed in a journal per mode, removed once
+    all the results of the file are written.
+    Returns the paths of the result files and, with keep, the
+    results by mode instead of writing them (see save_metric)
+    """
+
+    metric = metric_name(file)
+    with log_context(metric):
+        # the table kept in memory is also being written, do not relabel it
+        data = read_table(file) if data is None else data.copy(deep = False)
         data = clean_input(data)
         logger.info(f"Running model for: {metric}")
 
-        # init storage dataframes
+        # init storage
         elements = data.columns
         predictors = config["predictors"]
-        results = init_storage(elements, predictors)
+        results_uni = init_storage(elements, predictors)
 
         # merge with predictors
         data = data.merge(predictors_data, right_index = True, 
@@ -64,32 +247,116 @@ def main(config_file: str) -> None:
 
         # run univariate model
         logger.info("Starting with univariate analysis")
-        output_dir_uni = os.path.join(output_dir, metric, "univariate")
-        os.makedirs(output_dir_uni, exist_ok = True) 
-
-        results = run_model(data, results, elements, predictors, config,
-                            mode = "uni")
-        for res_elem in results:
-            file = os.path.join(output_dir_uni, f"{res_elem}.tsv")
-            results[res_elem].dropna(axis = 0, how = "all").to_csv(file, sep = "\t")
+        metric_dir = os.path.join(output_dir, metric)
+        os.makedirs(os.path.join(metric_dir, MODE_DIRS["uni"]), exist_ok = True) 
+        journals = {mode: os.path.join(metric_dir, f"journal.{mode}.npz")
+                    for mode in MODE_DIRS}
+
+        results_uni = run_model(data, results_uni, elements, predictors, config,
+                                mode = "uni", jobs = jobs, journal = journals["uni"],
+                                resume = resume)
+        results = {"uni": results_uni}
         
         # run multivariate model (if applicable)
         if config["multi"]:
-            logger.info("Multivariate analysis selected. Continue.")
-            output_dir_multi = os.path.join(output_dir, metric, "multivariate")
-            os.makedirs(output_dir_multi, exist_ok = True) 
-
-            # restart storage
-            results = init_storage(elements, predictors)
-
-            elements, predictors, forced_predictors = multi_rules(output_dir_uni,
-                                                                config)
-            results = run_model(data, results, elements, predictors, config,
-                                mode = "multi")
-            if forced_predictors:
-                results = clean_multi(results, forced_predictors)
-            for res_elem in results:
-                file = os.path.join(output_dir_multi, f"{res_elem}.tsv")
-                results[res_elem].dropna(axis = 0, how = "all").to_csv(file, sep = "\t")
+            results["multi"] = run_multi(data, results_uni, config, metric_dir, jobs, resume)
+
+        if keep:
+            return ([], results)
+        store = store_file(config["output_dir"]) if config.get("results_store") else None
+        files = save_metric(metric_dir, results, store)
     
-    return None
\ No newline at end of file
+    return (files, {})
+
+def run_multi(data: pd.DataFrame,
+            results_uni,
+            config: dict,
+            metric_dir: str,
+            jobs: int = 1,
+            resume: bool = False):
+    """
+    Runs the multivariate models of one input file, with the
+    predictors selected from its univariate results
+    """
+
+    logger.info("Multivariate analysis selected. Continue.")
+    os.makedirs(os.path.join(metric_dir, MODE_DIRS["multi"]), exist_ok = True) 
+
+    # restart storage
+    results_multi = init_storage(results_uni.elements, results_uni.predictors)
+
+    # predictors from the univariate results
+    elements, predictors, forced_predictors = multi_rules(results_uni, config)
+    results_multi = run_model(data, results_multi, elements, predictors, config,
+                            mode = "multi", jobs = jobs,
+                            journal = os.path.join(metric_dir, "journal.multi.npz"), resume = resume)
+    if forced_predictors:
+        results_multi = clean_multi(results_multi, elements, forced_predictors)
+
+    return results_multi
+
+def shard_file(metric_dir: str,
+            shard: tuple) -> str:
+    """
+    Univariate results of shard (i, N) of an input file
+    """
+
+    return os.path.join(metric_dir, f"shard.{shard[0]}-of-{shard[1]}.npz")
+
+@profiled
+def run_shard(file: str,
+            predictors_data: pd.DataFrame,
+            config: dict,
+            output_dir: str,
+            shard: tuple,
+            jobs: int = 1,
+            resume: bool = False) -> str:
+    """
+    Runs the univariate models of shard (i, N) of one input file:
+    every N-th element from the i-th one. The results, without
+    FDR correction (done over all the elements once merged), are
+    kept in the shard file, a journal so that the shard can be
+    resumed. Returns its path
+    """
+
+    metric = metric_name(file)
+    with log_context(f"{metric} {shard[0]}/{shard[1]}"):
+        data = clean_input(read_table(file))
+        elements = data.columns[shard[0] - 1::shard[1]]
+        predictors = config["predictors"]
+        logger.info(f"Running model for: {metric} ({len(elements)} of {len(data.columns)} elements)")
+
+        # merge the elements of the shard with predictors
+        data = data[elements].merge(predictors_data, right_index = True,
+                                    left_index = True, how = "left")
+
+        metric_dir = os.path.join(output_dir, metric)
+        os.makedirs(metric_dir, exist_ok = True)
+        journal = shard_file(metric_dir, shard)
+        run_model(data, init_storage(elements, predictors), elements, predictors,
+                dict(config, correct_pvals = False), mode = "uni", jobs = jobs,
+                journal = journal, resume = resume)
+
+    return journal
+
+def save_metric(metric_dir: str,
+                results: dict,
+                store: str = None) -> list:
+    """
+    Writes the results of one input file (by mode), also to
+    the results store if given, and removes its journals.
+    Returns the paths of the result files
+    """
+
+    files = []
+    for mode, res in results.items():
+        files += write_results(res, os.path.join(metric_dir, MODE_DIRS[mode]))
+        if store is not None:
+            write_store(store, os.path.join(metric_dir, MODE_DIRS[mode]), res)
+
+    for mode in MODE_DIRS:
+        journal = os.path.join(metric_dir, f"journal.{mode}.npz")
+        if os.path.exists(journal):
+            os.remove(journal)
+
+    return files
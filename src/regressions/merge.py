@@ -0,0 +1,158 @@
+import os
+import re
+
+import daiquiri
+import pandas as pd
+
+from src import __logger_name__
+from src.globals import log_context
+from src.regressions.main import (MODE_DIRS, RESULTS_SETTINGS, input_fingerprint, metric_name, record_results,
+                                  run_multi, save_metric)
+from src.regressions.models import model_engine
+from src.regressions.store import store_file
+from src.regressions.utils import clean_input, correct_pvals, merge_shards, read_journal
+from src.utils.cache import load_cache
+from src.utils.io import list_tables, read_config, read_table
+from src.utils.profiling import profiled
+
+logger = daiquiri.getLogger(__logger_name__)
+
+SHARD_PATTERN = re.compile(r"shard\.(\d+)-of-(\d+)\.npz$")
+
+@profiled
+def main(config_file, jobs: int = 1, resume: bool = False) -> None:
+    """
+    Merges the shards of a sharded regressions run (regressions
+    --shard i/N) into the usual results: per input file, the
+    univariate results of all the shards are combined, their
+    p-values corrected over all the elements (as in an unsharded
+    run), then the multivariate models are run on them. Shard
+    files are removed once the results are written.
+    """
+
+    config = read_config(config_file)
+    config = config["general"]
+    model_engine(config)
+
+    inputs_dir = os.path.join(config["output_dir"], "input")
+    output_dir = os.path.join(config["output_dir"], "regressions", config["model"])
+    if not os.path.isdir(output_dir):
+        logger.critical(f"Regressions directory {output_dir} does not exist. Aborting run")
+        logger.critical("Run bbgregressions regressions --shard i/N for every shard first")
+        raise IOError("No regressions directory")
+
+    # input files with shards
+    shards = {}
+    for file in list_tables(inputs_dir):
+        metric_shards = find_shards(os.path.join(output_dir, metric_name(file)))
+        if metric_shards:
+            shards[file] = metric_shards
+        else:
+            logger.warning(f"No shards of {file}. Skipping")
+    if not shards:
+        logger.critical(f"No shards in {output_dir}. Aborting run")
+        logger.critical("Run bbgregressions regressions --shard i/N for every shard first")
+        raise IOError("No shards")
+
+    # load predictors (for the multivariate models)
+    predictors_data = pd.read_csv(config["predictors_file"], sep = "\t",
+                                index_col = config["sample_column"])
+
+    files = {file: merge_metric(os.path.join(inputs_dir, file), metric_shards, predictors_data, config,
+                                output_dir, jobs, resume)
+            for file, metric_shards in shards.items()}
+
+    # merged results are up to date for later (unsharded) runs
+    cache = load_cache(config["output_dir"], "regressions")
+    settings = {field: config.get(field) for field in RESULTS_SETTINGS}
+    keys = {file: input_fingerprint(os.path.join(inputs_dir, file), config, settings, cache) for file in files}
+    record_results(cache, files, keys, config, settings)
+
+    return None
+
+def find_shards(metric_dir: str) -> list:
+    """
+    Shard files of an input file, in shard order. Fails if some
+    shard is missing or the shards are from runs with different N
+    """
+
+    if not os.path.isdir(metric_dir):
+        return []
+    found = {}
+    for file in os.listdir(metric_dir):
+        match = SHARD_PATTERN.match(file)
+        if match:
+            found[(int(match[1]), int(match[2]))] = os.path.join(metric_dir, file)
+    if not found:
+        return []
+
+    n_shards = {n for _, n in found}
+    if len(n_shards) > 1:
+        logger.critical(f"Shards of runs with different number of shards {sorted(n_shards)} in {metric_dir}")
+        logger.critical("Remove the shard files of the runs that are not to be merged")
+        raise IOError("Shards of different runs")
+    n_shards = n_shards.pop()
+    missing = [i for i in range(1, n_shards + 1) if (i, n_shards) not in found]
+    if missing:
+        logger.critical(f"Missing shards {missing} of {n_shards} in {metric_dir}")
+        logger.critical("Run/re-run them with bbgregressions regressions --shard i/N")
+        raise IOError("Missing shards")
+
+    return [found[(i, n_shards)] for i in range(1, n_shards + 1)]
+
+@profiled
+def merge_metric(file: str,
+                shards: list,
+                predictors_data: pd.DataFrame,
+                config: dict,
+                output_dir: str,
+                jobs: int = 1,
+                resume: bool = False) -> list:
+    """
+    Merges the shards of one input file, corrects the p-values,
+    runs the multivariate models (if multi) and writes the results.
+    Returns the paths of the result files
+    """
+
+    metric = metric_name(file)
+    metric_dir = os.path.join(output_dir, metric)
+    with log_context(metric):
+        logger.info(f"Merging {len(shards)} shards")
+        parts = []
+        for shard in shards:
+            results, complete = read_journal(shard)
+            if not complete:
+                logger.critical(f"Shard {shard} is not finished")
+                logger.critical("Re-run it with bbgregressions regressions --shard i/N --resume")
+                raise IOError("Unfinished shard")
+            parts.append(results)
+        if any(part.predictors.tolist() != config["predictors"] for part in parts):
+            logger.critical(f"Shards of {metric} were run with other predictors than {config['predictors']}")
+            raise IOError("Shards of different predictors")
+        results_uni = merge_shards(parts)
+        data = clean_input(read_table(file))
+        if data.columns.tolist() != results_uni.elements.tolist():
+            logger.critical(f"Shards of {metric} do not match its input table (re-created since?)")
+            logger.critical("Re-run all the shards with bbgregressions regressions --shard i/N --force")
+            raise IOError("Shards of a different input")
+        # elements as labelled in the input (the shards only keep their names)
+        results_uni.elements = data.columns
+
+        # FDR over all the elements
+        if config["correct_pvals"]:
+            results_uni = correct_pvals(results_uni)
+        results = {"uni": results_uni}
+        os.makedirs(os.path.join(metric_dir, MODE_DIRS["uni"]), exist_ok = True)
+
+        # run multivariate model (if applicable)
+        if config["multi"]:
+            data = data.merge(predictors_data, right_index = True, left_index = True, how = "left")
+            results["multi"] = run_multi(data, results_uni, config, metric_dir, jobs, resume)
+
+        store = store_file(config["output_dir"]) if config.get("results_store") else None
+        files = save_metric(metric_dir, results, store)
+        for shard in shards:
+            os.remove(shard)
+        logger.info(f"Results of {len(results_uni.elements)} elements written")
+
+    return files
@@ -1,14 +1,25 @@
+import time
 from itertools import product
 
 import daiquiri
+import numpy as np
 import pandas as pd
 import statsmodels.formula.api as smf
 
 from src import __logger_name__
-from src.regressions.utils import add_intercept, correct_pvals, fill_storage
+from src.regressions.batched import FIT_STATS, mixedlm, ols
+from src.regressions.schema import DEFAULT_ENGINE, ENGINE_OPTIONS
+from src.regressions.utils import (Storage, add_intercept, correct_pvals,
+                                   fill_storage, fill_storage_batch, journal_key,
+                                   load_journal, save_journal, summarize)
+from src.utils.parallel import call_with_timeout, close_timeout_worker, parallel_imap
+from src.utils.profiling import is_enabled, profiled, record_fit
 
 logger = daiquiri.getLogger(__logger_name__)
 
+# minimum seconds between checkpoints of the journal
+CHECKPOINT_SECONDS = 60
+
 
 def linear(data: pd.DataFrame, formula: str, config: dict):
     """ """
@@ -21,8 +32,11 @@ def linear(data: pd.DataFrame, formula: str, config: dict):
 def linear_me(data: pd.DataFrame, formula: str, config: dict):
     """ """
     rand_effect = config["predictor_random_effect"]
+    fit_kwargs = {}
+    if config.get("fit_maxiter"):
+        fit_kwargs["maxiter"] = int(config["fit_maxiter"])
     mod = smf.mixedlm(formula=formula, data=data, groups=data[rand_effect], missing="drop")
-    res = mod.fit()
+    res = mod.fit(**fit_kwargs)
 
     return res
 
@@ -30,22 +44,256 @@ def linear_me(data: pd.DataFrame, formula: str, config: dict):
 MODELS = {"linear": linear, "linear-mixed-effects": linear_me}
 
 
-def main(data: pd.DataFrame, results: dict, elements: list, predictors: list, config: dict, mode=str) -> dict:
+def fit_summary(data: pd.DataFrame, formula: str, config: dict) -> dict:
+    """
+    Runs the model and keeps its estimates and convergence status
+    """
+    model = MODELS[config["model"]]
+    model_res = model(data, formula, config)
+    summary = summarize(model_res)
+    summary["converged"] = getattr(model_res, "converged", True)
+
+    return summary
+
+
+def run_fit(data: pd.DataFrame, formula: str, config: dict) -> tuple:
+    """
+    Runs one model within the time budget of the config. With
+    fit_timeout set, the fit runs in a worker process (shared by
+    the fits on the same data), killed when the budget is exceeded.
+
+    Returns the summarized fit (None if it could not be obtained)
+    and the reason to report it in the diagnostics (None if fine)
+    """
+    timeout = config.get("fit_timeout")
+    if timeout:
+        reason, summary = call_with_timeout(fit_summary, (formula, config), float(timeout), shared=(data,))
+        if reason == "timeout":
+            logger.warning(f"Model {formula} did not finish in {timeout}s. Results set to NA.")
+            return (None, "timeout")
+        elif reason == "error":
+            logger.warning(f"Model {formula} failed ({summary}). Results set to NA.")
+            return (None, "error")
+    else:
+        summary = fit_summary(data, formula, config)
+
+    if not summary["converged"]:
+        return (summary, "not_converged")
+
+    return (summary, None)
+
+
+def design_matrix(data: pd.DataFrame, predictors: str, intercept: str) -> tuple:
+    """
+    Names of the model terms and design matrix (samples x terms)
+    """
+    terms = predictors.split("+")
+    X = data[terms].to_numpy(dtype=float)
+    if intercept == " + 1":
+        X = np.column_stack([X, np.ones(len(X))])
+        terms = terms + ["Intercept"]
+
+    return (terms, X)
+
+
+def random_effect_groups(data: pd.DataFrame, config: dict) -> np.ndarray:
+    """
+    Integer code of the random effect group of each sample (-1 if missing)
+    """
+    codes, _ = pd.factorize(data[config["predictor_random_effect"]])
+
+    return codes
+
+
+def linear_batch(
+    data: pd.DataFrame, elements: list, predictors: str, intercept: str, config: dict, groups=None
+) -> dict:
+    """
+    Fits the same predictors for all the elements at once
+    """
+    terms, X = design_matrix(data, predictors, intercept)
+    res = ols(X, data[elements].to_numpy(dtype=float))
+    res["terms"] = terms
+
+    return res
+
+
+def linear_me_batch(
+    data: pd.DataFrame, elements: list, predictors: str, intercept: str, config: dict, groups=None
+) -> dict:
+    """
+    Fits the same predictors with a random intercept for all the
+    elements at once. Elements the batch cannot fit are run with
+    statsmodels, as with the statsmodels engine.
+    """
+    terms, X = design_matrix(data, predictors, intercept)
+    res = mixedlm(X, data[elements].to_numpy(dtype=float), groups)
+    res["terms"] = terms
+
+    failed = np.flatnonzero(res["failed"])
+    if len(failed):
+        res["diagnostics"] = []
+        for i in failed:
+            formula = f"{elements[i]} ~ {predictors}{intercept}"
+            logger.debug(f"Batch fit failed, running with statsmodels: {formula}")
+            model_res, reason = run_fit(data, formula, config)
+            if reason:
+                res["diagnostics"].append((elements[i], predictors, reason))
+            if model_res is None:
+                continue
+            for stat in FIT_STATS:
+                if stat in model_res:
+                    res[stat][i] = model_res[stat][terms].to_numpy()
+
+    return res
+
+
+BATCH_MODELS = {"linear": linear_batch, "linear-mixed-effects": linear_me_batch}
+
+
+def model_engine(config: dict) -> str:
+    """
+    Engine the models are run with (see schema.ENGINE_OPTIONS).
+    Fails on unknown engines
+    """
+    engine = config.get("engine") or DEFAULT_ENGINE
+    if engine not in ENGINE_OPTIONS:
+        logger.critical(f"Unknown engine {engine}. Aborting run")
+        logger.critical(f"Select between {', '.join(ENGINE_OPTIONS)} (or leave empty for {DEFAULT_ENGINE})")
+        raise IOError("Unknown engine")
+
+    return engine
+
+
+# data and config of the running fits, set once per worker process
+WORKER_STATE = {}
+
+
+def init_worker(data: pd.DataFrame, config: dict) -> None:
     """ """
+    WORKER_STATE["data"] = data
+    WORKER_STATE["config"] = config
+
+
+def fit(element: str, predictors: str) -> tuple:
+    """
+    Runs the model for one element and predictor(s) using
+    the data shared with the worker
+    """
+    data = WORKER_STATE["data"]
+    config = WORKER_STATE["config"]
+    intercept = add_intercept(predictors, config)
+
+    formula = f"{element} ~ {predictors}{intercept}"
+    logger.debug(f"Running: {formula}")
+
+    start = time.perf_counter()
+    output = run_fit(data, formula, config)
+    if is_enabled():
+        record_fit(config["model"], time.perf_counter() - start)
+
+    return output
+
+
+@profiled
+def main(
+    data: pd.DataFrame,
+    results: Storage,
+    elements: list,
+    predictors: list,
+    config: dict,
+    mode=str,
+    jobs: int = 1,
+    journal: str = None,
+    resume: bool = False,
+) -> Storage:
+    """
+    Runs the models of one analysis mode. With a journal file, the
+    fits done are checkpointed (at most every CHECKPOINT_SECONDS);
+    with resume, fits already in the journal are not run again,
+    unless it is from other data, settings or terms.
+    """
+
+    done = np.zeros((len(results.elements), len(results.predictors)), dtype=bool)
+    complete = False
+    key = journal_key(data, config, mode, elements, predictors) if journal else ""
+    if journal and resume:
+        results, done, complete = load_journal(results, journal, key)
+    last_checkpoint = time.monotonic()
+
+    engine = model_engine(config)
+    if engine == "vectorized" and config["model"] not in BATCH_MODELS:
+        logger.warning(f"Vectorized engine not available for {config['model']}. Using statsmodels.")
+        engine = "statsmodels"
+
+    if complete:
+        logger.info("All models were already run. Using checkpointed results.")
+
+    elif engine == "vectorized":
+        # elements fitted with the same predictors are solved together
+        if mode == "uni":
+            groups = {predictor: list(elements) for predictor in predictors}
+        elif mode == "multi":
+            groups = {}
+            for element, element_predictors in zip(elements, predictors):
+                groups.setdefault(element_predictors, []).append(element)
+            logger.info(f"{len(elements)} elements share {len(groups)} distinct predictor sets")
+
+        # random effect groups are shared by all the fits
+        random_groups = None
+        if config["model"] == "linear-mixed-effects":
+            random_groups = random_effect_groups(data, config)
+
+        model = BATCH_MODELS[config["model"]]
+        for group_predictors, group in groups.items():
+            cols = results.cols(group_predictors.split("+"))
+            if done[results.rows(group)[:, None], cols].all():
+                continue
+            intercept = add_intercept(group_predictors, config)
+            logger.debug(f"Running: {len(group)} elements ~ {group_predictors}{intercept}")
+            start = time.perf_counter()
+            model_res = model(data, group, group_predictors, intercept, config, random_groups)
+            if is_enabled():
+                # time per element of the batch
+                record_fit(f"{config['model']} (vectorized)", (time.perf_counter() - start) / len(group), len(group))
+            results = fill_storage_batch(results, model_res, group, group_predictors, intercept)
+            results.diagnostics.extend(model_res.get("diagnostics", []))
+            if journal:
+                done[results.rows(group)[:, None], cols] = True
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                    save_journal(results, done, journal, key=key)
+                    last_checkpoint = time.monotonic()
 
-    if mode == "uni":
-        terms = product(elements, predictors)
-    elif mode == "multi":
-        terms = zip(elements, predictors)
+    else:
+        if mode == "uni":
+            terms = list(product(elements, predictors))
+        elif mode == "multi":
+            terms = list(zip(elements, predictors))
+        terms = [
+            (element, predictors)
+            for element, predictors in terms
+            if not done[results.rows([element])[0], results.cols(predictors.split("+"))].all()
+        ]
 
-    for element, predictors in terms:
-        intercept = add_intercept(predictors, config)
+        if jobs > 1:
+            logger.info(f"Running {len(terms)} models in {jobs} parallel processes")
+        # results come back as they finish (in order), to be checkpointed
+        models_res = parallel_imap(fit, terms, jobs, initializer=init_worker, initargs=(data, config))
+        for (element, predictors), (model_res, reason) in zip(terms, models_res):
+            if reason:
+                results.diagnostics.append((element, predictors, reason))
+            if model_res is not None:
+                intercept = add_intercept(predictors, config)
+                results = fill_storage(results, model_res, element, predictors, intercept)
+            if journal:
+                done[results.rows([element])[0], results.cols(predictors.split("+"))] = True
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                    save_journal(results, done, journal, key=key)
+                    last_checkpoint = time.monotonic()
 
-        formula = f"{element} ~ {predictors}{intercept}"
-        logger.debug(f"Running: {formula}")
-        model = MODELS[config["model"]]
-        model_res = model(data, formula, config)
-        results = fill_storage(results, model_res, element, predictors, intercept)
+    close_timeout_worker()
+    if journal:
+        save_journal(results, done, journal, complete=True, key=key)
 
     if config["correct_pvals"]:
         results = correct_pvals(results)
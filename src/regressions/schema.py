@@ -1 +1,12 @@
+MODEL_OPTIONS = ["linear", "linear-mixed-effects"]
 MULTI_OPTIONS = ["yes", "no"]
+ENGINE_OPTIONS = ["statsmodels", "vectorized"]
+DEFAULT_ENGINE = "statsmodels"
+# formats of the tables passed from create_input to regressions
+TABLE_FORMATS = ["tsv", "npy", "both"]
+DEFAULT_TABLE_FORMAT = "tsv"
+# general config fields that change the model results of an input file
+RESULTS_SETTINGS = ["model", "engine", "multi", "sample_column", "predictors",
+                    "predictors_intercept_0", "predictor_random_effect",
+                    "predictors_multi_force", "correct_pvals", "significance_threshold",
+                    "fit_timeout", "fit_maxiter"]
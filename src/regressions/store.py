@@ -0,0 +1,281 @@
+"""
+Optional SQLite store of the regressions results of a run, in long
+format: one row per model, metric, mode, element and predictor,
+indexed by element and by predictor, so results can be looked up
+across metrics without reading the result tables.
+"""
+import os
+import sqlite3
+from contextlib import closing
+
+import daiquiri
+import numpy as np
+import pandas as pd
+
+from src import __logger_name__
+from src.regressions.utils import RES_ELEMENTS, Storage
+from src.utils.cache import load_cache
+from src.utils.profiling import profiled
+
+logger = daiquiri.getLogger(__logger_name__)
+
+STORE_FILE = "results.sqlite"
+STORE_KEYS = ["model", "metric", "mode", "element", "predictor"]
+STORE_VALUES = ["coeff", "low_ci", "high_ci", "pval", "qval", "intercept"]
+# seconds to wait while another process writes to the store
+STORE_TIMEOUT = 600
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS results (
+    {", ".join(f"{key} TEXT NOT NULL" for key in STORE_KEYS)},
+    {", ".join(f"{value} REAL" for value in STORE_VALUES)},
+    PRIMARY KEY ({", ".join(STORE_KEYS)})
+);
+CREATE INDEX IF NOT EXISTS results_element ON results (element, predictor);
+CREATE INDEX IF NOT EXISTS results_predictor ON results (predictor, element);
+CREATE TABLE IF NOT EXISTS modes (
+    model TEXT NOT NULL, metric TEXT NOT NULL, mode TEXT NOT NULL, results_key TEXT, corrected INTEGER,
+    PRIMARY KEY (model, metric, mode)
+);
+"""
+
+
+def store_file(output_dir: str) -> str:
+    """
+    Results store of a run.
+    """
+    return os.path.join(output_dir, "regressions", STORE_FILE)
+
+
+def mode_key(mode_dir: str) -> tuple:
+    """
+    (model, metric, mode) of a results directory
+    (regressions/<model>/<metric>/<mode>).
+    """
+    return tuple(os.path.normpath(mode_dir).split(os.sep)[-3:])
+
+
+def mode_sources(mode_dir: str) -> list:
+    """
+    Result files of a mode (those plots are made from).
+    """
+    return [os.path.join(mode_dir, file) for file in sorted(os.listdir(mode_dir))]
+
+
+def results_keys(output_dir: str) -> dict:
+    """
+    Fingerprint regressions recorded in its cache for the results
+    of each (model, metric, mode): that of the input file and the
+    settings they were computed from.
+    """
+    cache = load_cache(output_dir, "regressions")
+    keys = {}
+    for entry in cache["artifacts"].values():
+        for output in entry["outputs"]:
+            keys[mode_key(os.path.dirname(output))] = entry["fingerprint"]
+    return keys
+
+
+def connect(file: str, create: bool = False) -> sqlite3.Connection:
+    """
+    Connection to the store, created with its schema if create is
+    set. Writers wait for each other (e.g. parallel input files).
+    """
+    if not create and not os.path.exists(file):
+        logger.critical(f"Results store {file} does not exist")
+        logger.critical("Set results_store and run/re-run bbgregressions regressions, or run bbgregressions results build")
+        raise IOError("No results store")
+    conn = sqlite3.connect(file, timeout=STORE_TIMEOUT)
+    if create:
+        with conn:
+            # modes of stores of previous versions (otherwise keyed) are all stale
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(modes)")]
+            if columns and "results_key" not in columns:
+                conn.execute("DROP TABLE modes")
+            conn.executescript(SCHEMA)
+    return conn
+
+
+@profiled
+def write_store(file: str, mode_dir: str, results: Storage, key: str = None) -> None:
+    """
+    Replaces the results of the mode of mode_dir in the store, once
+    its result tables are written: every predictor of the elements
+    with some result (as the tables, which drop the elements without
+    results). NAs are NULL. key is the fingerprint regressions
+    records for them (see results_keys); until set (see record_keys),
+    the stored results are not taken as current.
+    """
+    model, metric, mode = mode_key(mode_dir)
+    shape = (len(results.elements), len(results.predictors))
+    values = np.stack([results.values.get(value, np.full(shape, np.nan)) for value in STORE_VALUES], axis=-1)
+    kept = ~np.isnan(values).all(axis=(1, 2))
+    elements = results.elements[kept].astype(str).tolist()
+    predictors = results.predictors.astype(str).tolist()
+
+    # element-major rows, as the result tables (SQLite stores NaN as NULL)
+    n_rows = len(elements) * len(predictors)
+    columns = [[model] * n_rows, [metric] * n_rows, [mode] * n_rows,
+            [element for element in elements for _ in predictors], predictors * len(elements)]
+    columns += [values[kept, :, i].ravel().tolist() for i in range(len(STORE_VALUES))]
+    placeholders = ", ".join("?" * len(columns))
+
+    with closing(connect(file, create=True)) as conn, conn:
+        conn.execute("DELETE FROM results WHERE model = ? AND metric = ? AND mode = ?", (model, metric, mode))
+        conn.executemany(f"INSERT INTO results VALUES ({placeholders})", zip(*columns))
+        conn.execute("INSERT OR REPLACE INTO modes VALUES (?, ?, ?, ?, ?)",
+                    (model, metric, mode, key, "qval" in results.values))
+
+
+def read_results(mode_dir: str) -> Storage:
+    """
+    Results of one mode from its result tables, for the store.
+    """
+    frames = {}
+    for value in STORE_VALUES:
+        file = os.path.join(mode_dir, f"{value}.tsv")
+        if os.path.exists(file):
+            frames[value] = pd.read_csv(file, sep="\t", index_col=0)
+            frames[value].index = frames[value].index.astype(str)
+    elements = list(dict.fromkeys(element for frame in frames.values() for element in frame.index))
+    results = Storage(elements, frames["coeff"].columns)
+    for value, frame in frames.items():
+        results[value] = frame.reindex(index=results.elements, columns=results.predictors).to_numpy(dtype=float)
+
+    return results
+
+
+def import_results(file: str, mode_dir: str, key: str = None) -> None:
+    """
+    Adds the results of one mode (regressions/<model>/<metric>/<mode>)
+    from its result tables to the store.
+    """
+    write_store(file, mode_dir, read_results(mode_dir), key)
+
+
+def record_keys(file: str, keys: dict) -> None:
+    """
+    Sets the fingerprint of the stored results of each (model,
+    metric, mode) in keys, once regressions recorded it in its cache.
+    """
+    with closing(connect(file, create=True)) as conn, conn:
+        conn.executemany("UPDATE modes SET results_key = ? WHERE model = ? AND metric = ? AND mode = ?",
+                        [(key, *mode) for mode, key in keys.items()])
+
+
+def stored_modes(file: str, keys: dict) -> set:
+    """
+    (model, metric, mode) whose current results are in the store:
+    stored with the fingerprint regressions last recorded for them
+    (keys, see results_keys), so no result table is read.
+    """
+    if not os.path.exists(file):
+        return set()
+    with closing(connect(file)) as conn:
+        return {tuple(row[:3]) for row in conn.execute("SELECT * FROM modes")
+                if row[3] is not None and keys.get(tuple(row[:3])) == row[3]}
+
+
+def is_stored(modes: set, mode_dir: str) -> bool:
+    """
+    Whether the store has the current results of mode_dir (see
+    stored_modes), not those of previous tables.
+    """
+    return mode_key(mode_dir) in modes
+
+
+def build_store(file: str, mode_dirs: list, keys: dict, force: bool = False) -> int:
+    """
+    Adds the results of mode_dirs to the store from their result
+    tables, unless the store has them already (or force is set).
+    keys are the fingerprints regressions recorded for them (see
+    results_keys). Returns the number of modes added.
+    """
+    modes = stored_modes(file, keys)
+    mode_dirs = [mode_dir for mode_dir in mode_dirs if force or not is_stored(modes, mode_dir)]
+    for mode_dir in mode_dirs:
+        import_results(file, mode_dir, keys.get(mode_key(mode_dir)))
+
+    return len(mode_dirs)
+
+
+@profiled
+def query(
+    file: str,
+    model=None,
+    metric=None,
+    mode=None,
+    elements: list = None,
+    predictors: list = None,
+    max_sign: float = None,
+) -> pd.DataFrame:
+    """
+    Results in the store, one row per model, metric, mode, element
+    and predictor, in the order they were stored.
+
+    Parameters
+    ----------
+    file: str
+        Results store.
+    model, metric, mode: str or list, optional
+        Keep only these models, metrics (e.g.
+        mutdensity_mb.protein_affecting.snv) and modes (univariate,
+        multivariate).
+    elements, predictors: list, optional
+        Keep only these elements and predictors (indexed lookups).
+    max_sign: float, optional
+        Keep only results with a q-value (p-value if not corrected)
+        below max_sign.
+
+    Returns
+    -------
+    pd.DataFrame
+        STORE_KEYS and STORE_VALUES columns (NAs for NULL).
+    """
+    where, params = [], []
+    filters = {"model": model, "metric": metric, "mode": mode, "element": elements, "predictor": predictors}
+    for key, values in filters.items():
+        if values is None:
+            continue
+        values = [values] if isinstance(values, str) else list(values)
+        where.append(f"{key} IN ({', '.join('?' * len(values))})")
+        params += values
+    if max_sign is not None:
+        where.append("COALESCE(qval, pval) < ?")
+        params.append(max_sign)
+
+    sql = "SELECT * FROM results"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with closing(connect(file)) as conn:
+        data = pd.read_sql_query(f"{sql} ORDER BY rowid", conn, params=params)
+    data[STORE_VALUES] = data[STORE_VALUES].astype(float)
+
+    return data
+
+
+def results_frames(file: str, model: str, metric: str, mode: str) -> dict:
+    """
+    Results of one model, metric and mode from the store, as
+    plot.utils.regressions_reader reads them from the result tables
+    (elements x predictors by result type, "sign" being the
+    q-values if computed, i.e. if there is a qval table, else the
+    p-values).
+    """
+    data = query(file, model, metric, mode)
+    elements = pd.Index(data["element"].unique())
+    predictors = pd.Index(data["predictor"].unique())
+    with closing(connect(file)) as conn:
+        row = conn.execute("SELECT corrected FROM modes WHERE model = ? AND metric = ? AND mode = ?",
+                        (model, metric, mode)).fetchone()
+    sign = "qval" if row is not None and row[0] else "pval"
+
+    frames = {}
+    for value in RES_ELEMENTS + ["qval"]:
+        if value in ["pval", "qval"] and value != sign:
+            continue
+        frame = data.pivot(index="element", columns="predictor", values=value)
+        frame = frame.reindex(index=elements, columns=predictors).rename_axis(index=None, columns=None)
+        frames["sign" if value == sign else value] = frame.dropna(axis=0, how="all")
+
+    return frames
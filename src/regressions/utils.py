@@ -1,10 +1,14 @@
 import daiquiri
+import hashlib
+import json
 import pandas as pd
 import os
 import numpy as np
 from statsmodels.stats.multitest import fdrcorrection
 
-from src import __logger_name__
+from src import __logger_name__, __version__
+from src.regressions.schema import RESULTS_SETTINGS
+from src.utils.profiling import profiled
 
 logger = daiquiri.getLogger(__logger_name__)
 
@@ -18,45 +22,277 @@ def clean_input(data: pd.DataFrame) -> pd.DataFrame:
 
     return data
 
+RES_ELEMENTS = ["coeff", "low_ci", "high_ci", "pval", "intercept"]
+# fits left as NA or flagged, with the reason (timeout, error, not_converged)
+DIAGNOSTICS_COLUMNS = ["element", "predictors", "reason"]
+
+class Storage:
+    """
+    Model results kept as float64 arrays (elements x predictors)
+    filled by position. DataFrames are only built when writing.
+    Fits that timed out, failed or did not converge are
+    listed in diagnostics. no_intercept marks the results of
+    models without intercept (intercept forced through zero).
+    """
+
+    def __init__(self, elements: list, predictors: list):
+        self.elements = pd.Index(elements)
+        self.predictors = pd.Index(predictors)
+        self.diagnostics = []
+        self.values = {}
+        for res_elem in RES_ELEMENTS:
+            self.values[res_elem] = np.full((len(self.elements), len(self.predictors)), np.nan)
+        self.no_intercept = np.zeros((len(self.elements), len(self.predictors)), dtype = bool)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, res_elem: str) -> np.ndarray:
+        return self.values[res_elem]
+
+    def __setitem__(self, res_elem: str, values: np.ndarray) -> None:
+        self.values[res_elem] = values
+
+    def rows(self, elements: list) -> np.ndarray:
+        return self.elements.get_indexer(elements)
+
+    def cols(self, predictors: list) -> np.ndarray:
+        return self.predictors.get_indexer(predictors)
+
+    def to_frame(self, res_elem: str) -> pd.DataFrame:
+        return pd.DataFrame(self.values[res_elem], index = self.elements,
+                            columns = self.predictors)
+
 def init_storage(elements: list,
-                predictors: list) -> dict:
+                predictors: list) -> Storage:
     """
     """
 
-    res_elements = ["coeff", "low_ci", "high_ci", 
-                    "pval", "intercept"]
-    results = {}
-    
-    for res_elem in res_elements:
-        results[res_elem] = pd.DataFrame(index = elements,
-                                        columns = predictors)
-    
-    return results
+    return Storage(elements, predictors)
 
-def fill_storage(results: dict,
-                model_res,
+def summarize(model_res) -> dict:
+    """
+    Keeps the estimates needed to fill the storage,
+    so fits can be sent back from worker processes
+    """
+
+    conf_int = model_res.conf_int()
+    return {"params": model_res.params,
+            "pvalues": model_res.pvalues,
+            "low_ci": conf_int[0],
+            "high_ci": conf_int[1]}
+
+@profiled
+def fill_storage(results: Storage,
+                model_res: dict,
                 element: str,
                 predictors: str,
-                intercept: str) -> dict:
+                intercept: str) -> Storage:
     """
     """
 
     predictors = predictors.split("+")
-    for predictor in predictors:
-        
-        if np.isnan(model_res.pvalues[predictor]):
-            results["coeff"].loc[element, predictor] = np.nan
-            logger.warning(f"Model could not be computed for {element}-{predictor}. Results set to NA.")
-        else:
-            results["coeff"].loc[element, predictor] = model_res.params[predictor]
-        results["low_ci"].loc[element, predictor] = model_res.conf_int().loc[predictor][0]
-        results["high_ci"].loc[element, predictor] = model_res.conf_int().loc[predictor][1]
-        results["pval"].loc[element, predictor] = model_res.pvalues[predictor]
-        if intercept == " - 1":
-            results["intercept"].loc[element, predictor] = 0
-        elif intercept == " + 1":
-            results["intercept"].loc[element, predictor] = model_res.params["Intercept"]
-        
+    row = results.rows([element])[0]
+    cols = results.cols(predictors)
+
+    pvals = model_res["pvalues"][predictors].to_numpy()
+    coeff = model_res["params"][predictors].to_numpy()
+    for predictor in np.asarray(predictors)[np.isnan(pvals)]:
+        logger.warning(f"Model could not be computed for {element}-{predictor}. Results set to NA.")
+
+    results["coeff"][row, cols] = np.where(np.isnan(pvals), np.nan, coeff)
+    results["low_ci"][row, cols] = model_res["low_ci"][predictors].to_numpy()
+    results["high_ci"][row, cols] = model_res["high_ci"][predictors].to_numpy()
+    results["pval"][row, cols] = pvals
+    results.no_intercept[row, cols] = intercept == " - 1"
+    if intercept == " - 1":
+        results["intercept"][row, cols] = 0
+    elif intercept == " + 1":
+        results["intercept"][row, cols] = model_res["params"]["Intercept"]
+
+    return results
+
+@profiled
+def fill_storage_batch(results: Storage,
+                    model_res: dict,
+                    elements: list,
+                    predictors: str,
+                    intercept: str) -> Storage:
+    """
+    Same as fill_storage for a batch of elements
+    fitted with the same predictors
+    """
+
+    elements = np.asarray(elements)
+    predictors = predictors.split("+")
+    rows = results.rows(elements)[:, None]
+    cols = results.cols(predictors)
+    pos = [model_res["terms"].index(predictor) for predictor in predictors]
+
+    pvals = model_res["pvalues"][:, pos]
+    failed = np.isnan(pvals)
+    for i, j in zip(*np.nonzero(failed)):
+        logger.warning(f"Model could not be computed for {elements[i]}-{predictors[j]}. Results set to NA.")
+
+    results["coeff"][rows, cols] = np.where(failed, np.nan, model_res["params"][:, pos])
+    results["low_ci"][rows, cols] = model_res["low_ci"][:, pos]
+    results["high_ci"][rows, cols] = model_res["high_ci"][:, pos]
+    results["pval"][rows, cols] = pvals
+    results.no_intercept[rows, cols] = intercept == " - 1"
+    if intercept == " - 1":
+        results["intercept"][rows, cols] = 0
+    elif intercept == " + 1":
+        results["intercept"][rows, cols] = model_res["params"][:, [model_res["terms"].index("Intercept")]]
+
+    return results
+
+@profiled
+def write_results(results: Storage,
+                output_dir: str) -> list:
+    """
+    Writes one TSV per result type, skipping elements without results.
+    Returns the paths of the written files
+    """
+
+    files = []
+    for res_elem in results:
+        res = results.to_frame(res_elem)
+        if res_elem == "intercept":
+            # intercepts of models without intercept are written as 0, not 0.0
+            res = res.astype(object).mask(results.no_intercept & res.notna().to_numpy(), 0)
+        file = os.path.join(output_dir, f"{res_elem}.tsv")
+        res.dropna(axis = 0, how = "all").to_csv(file, sep = "\t")
+        files.append(file)
+
+    # only written when some fit needs attention
+    file = os.path.join(output_dir, "diagnostics.tsv")
+    if results.diagnostics:
+        diagnostics = pd.DataFrame(results.diagnostics, columns = DIAGNOSTICS_COLUMNS)
+        diagnostics.to_csv(file, sep = "\t", index = False)
+        files.append(file)
+    elif os.path.exists(file):
+        os.remove(file)
+
+    return files
+
+def journal_key(data: pd.DataFrame,
+                config: dict,
+                mode: str,
+                elements: list,
+                predictors: list) -> str:
+    """
+    Fingerprint of the fits of a journal: the data, the settings
+    that change the results, the fitted terms and the tool version
+    """
+
+    data_hash = hashlib.sha256(pd.util.hash_pandas_object(data, index = True).to_numpy().tobytes())
+    data_hash.update(json.dumps(data.columns.astype(str).tolist()).encode())
+    content = {
+        "version": __version__,
+        "data": data_hash.hexdigest(),
+        "settings": {field: config.get(field) for field in RESULTS_SETTINGS},
+        "mode": mode,
+        "terms": [list(elements), list(predictors)],
+    }
+
+    return hashlib.sha256(json.dumps(content, sort_keys = True, default = str).encode()).hexdigest()
+
+def save_journal(results: Storage,
+                done: np.ndarray,
+                file: str,
+                complete: bool = False,
+                key: str = "") -> None:
+    """
+    Checkpoints the fits done so far (done marks the filled
+    element-predictor cells), with the key of the fits (see
+    journal_key). Written to a temporary file first, so a crash
+    while saving keeps the previous checkpoint.
+    """
+
+    values = {f"res_{res_elem}": results[res_elem] for res_elem in results}
+    diagnostics = np.array(results.diagnostics, dtype = str).reshape(-1, len(DIAGNOSTICS_COLUMNS))
+    tmp_file = f"{file}.tmp"
+    with open(tmp_file, "wb") as fh:
+        np.savez(fh, elements = results.elements.to_numpy(dtype = str),
+                predictors = results.predictors.to_numpy(dtype = str),
+                done = done, complete = complete, diagnostics = diagnostics, key = key,
+                no_intercept = results.no_intercept, **values)
+    os.replace(tmp_file, file)
+
+    return None
+
+def load_journal(results: Storage,
+                file: str,
+                key: str = "") -> tuple:
+    """
+    Restores the checkpointed fits into results, unless they were
+    run on other data, settings or terms (key). Returns the
+    storage, the mask of fits already done and whether the
+    journal covers the whole analysis.
+    """
+
+    done = np.zeros((len(results.elements), len(results.predictors)), dtype = bool)
+    if not os.path.exists(file):
+        return (results, done, False)
+
+    journal = np.load(file)
+    if (journal["elements"].tolist() != results.elements.astype(str).tolist()
+        or journal["predictors"].tolist() != results.predictors.astype(str).tolist()
+        or "key" not in journal or str(journal["key"]) != key):
+        logger.warning(f"Checkpoint {file} does not match the current input or settings. Starting over.")
+        return (results, done, False)
+
+    for res_elem in results:
+        results[res_elem] = journal[f"res_{res_elem}"]
+    if "no_intercept" in journal:
+        results.no_intercept = journal["no_intercept"]
+    results.diagnostics = [tuple(diagnostic) for diagnostic in journal["diagnostics"].tolist()]
+    done = journal["done"]
+    logger.info(f"Resuming from checkpoint: {done.any(axis = 1).sum()} elements with fits done")
+
+    return (results, done, bool(journal["complete"]))
+
+def read_journal(file: str) -> tuple:
+    """
+    Results checkpointed in a journal (e.g. that of a shard, see
+    regressions --shard) and whether it covers the whole analysis.
+    """
+
+    journal = np.load(file)
+    results = Storage(journal["elements"].tolist(), journal["predictors"].tolist())
+    for res_elem in results:
+        results[res_elem] = journal[f"res_{res_elem}"]
+    if "no_intercept" in journal:
+        results.no_intercept = journal["no_intercept"]
+    results.diagnostics = [tuple(diagnostic) for diagnostic in journal["diagnostics"].tolist()]
+
+    return (results, bool(journal["complete"]))
+
+def merge_shards(shards: list) -> Storage:
+    """
+    Results of an input file from those of its N shards, in shard
+    order (shard i has every N-th element from the i-th one), with
+    the elements back in input order.
+    """
+
+    n_shards = len(shards)
+    n_elements = sum(len(shard.elements) for shard in shards)
+    elements = np.empty(n_elements, dtype = object)
+    for i, shard in enumerate(shards):
+        if len(shard.elements) != len(range(i, n_elements, n_shards)):
+            raise ValueError(f"Shard {i + 1} of {n_shards} does not have the expected elements")
+        elements[i::n_shards] = shard.elements
+
+    results = Storage(elements, shards[0].predictors)
+    for i, shard in enumerate(shards):
+        for res_elem in shard:
+            results[res_elem][i::n_shards] = shard[res_elem]
+        results.no_intercept[i::n_shards] = shard.no_intercept
+        results.diagnostics += shard.diagnostics
+    # in element order, as in an unsharded run
+    position = {element: row for row, element in enumerate(elements)}
+    results.diagnostics.sort(key = lambda diagnostic: position[diagnostic[0]])
+
     return results
 
 def add_intercept(predictor_term: str, 
@@ -75,15 +311,18 @@ def add_intercept(predictor_term: str,
 
     return intercept
 
-def correct_pvals(results: dict) -> dict:
+@profiled
+def correct_pvals(results: Storage) -> Storage:
     """
     """
-    _, corr_pvals = fdrcorrection(results["pval"].values.flatten(),
-                                alpha = 0.05, method = 'indep', 
-                                is_sorted = False)
-    results["qval"] = pd.DataFrame(corr_pvals.reshape(results["pval"].shape),
-                                index = results["pval"].index, 
-                                columns = results["pval"].columns)
+    # only p-values of fitted models count as tests
+    pvals = results["pval"]
+    tested = ~np.isnan(pvals)
+    results["qval"] = np.full(pvals.shape, np.nan)
+    if tested.any():
+        _, results["qval"][tested] = fdrcorrection(pvals[tested],
+                                                alpha = 0.05, method = 'indep', 
+                                                is_sorted = False)
 
     return results
 
@@ -101,16 +340,13 @@ def update_predictors(predictors: set,
     
     return (predictors_upd, forced_predictors)
 
-def multi_rules(output_dir_uni: str,
+def multi_rules(results_uni: Storage,
                 config: dict) -> tuple:
     """
     """
-    if any("qval" in file for file in os.listdir(output_dir_uni)):
-        uni_file = os.path.join(output_dir_uni, "qval.tsv")
-    else:
-        uni_file = os.path.join(output_dir_uni, "pval.tsv")
-
-    data = pd.read_csv(uni_file, sep = "\t", index_col = 0)
+    # q-values if they were calculated, for the elements with results
+    res_elem = "qval" if "qval" in results_uni else "pval"
+    data = results_uni.to_frame(res_elem).dropna(axis = 0, how = "all")
     
     # elements analyzed
     elements = data.index.tolist()
@@ -167,18 +403,22 @@ def multi_rules(output_dir_uni: str,
         
         forced_predictors_upd = []
     
-    # format predictors for formula syntax
-    sign_predictors_upd = ["+".join(pred) for pred in sign_predictors_upd2]
+    # format predictors for formula syntax (in input order, so runs are reproducible)
+    sign_predictors_upd = ["+".join(pred for pred in predictors if pred in preds)
+                        for preds in sign_predictors_upd2]
 
     return (elements_upd, sign_predictors_upd, forced_predictors_upd)
 
-def clean_multi(results: dict,
-                forced_predictors: list) -> dict:
+def clean_multi(results: Storage,
+                elements: list,
+                forced_predictors: list) -> Storage:
     """
     """
-    for res_elem in results:
-        for elem, force_preds in zip(results[res_elem].index, forced_predictors):
-            if force_preds:
-                results[res_elem].loc[elem, force_preds] = np.nan
+    for elem, force_preds in zip(elements, forced_predictors):
+        if force_preds:
+            row = results.rows([elem])[0]
+            cols = results.cols(force_preds)
+            for res_elem in results:
+                results[res_elem][row, cols] = np.nan
     
     return results
@@ -0,0 +1,89 @@
+"""
+Fingerprint cache so pipeline stages can skip the artifacts
+whose sources, settings and tool version did not change.
+"""
+import hashlib
+import json
+import os
+
+from src import __version__
+
+CACHE_DIR = ".cache"
+# bytes read at a time when hashing source files
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def load_cache(output_dir: str, stage: str) -> dict:
+    """
+    Read the cache of a stage ({"artifacts": {...}, "files": {...}}),
+    empty if it does not exist or cannot be read.
+    """
+    path = os.path.join(output_dir, CACHE_DIR, f"{stage}.json")
+    try:
+        with open(path) as fh:
+            cache = json.load(fh)
+    except (OSError, ValueError):
+        cache = {}
+    cache.setdefault("artifacts", {})
+    cache.setdefault("files", {})
+    return cache
+
+
+def save_cache(output_dir: str, stage: str, cache: dict) -> None:
+    """
+    Write the cache of a stage (through a temporary file, so an
+    interrupted write never leaves a corrupt cache).
+    """
+    path = os.path.join(output_dir, CACHE_DIR, f"{stage}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as fh:
+        json.dump(cache, fh, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def file_hash(path: str, cache: dict) -> str:
+    """
+    sha256 of a file's content. Hashes are memoized in the cache by
+    path, size and modification time, so unchanged files are not read.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    memo = cache["files"].get(path)
+    if memo and memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+        return memo["sha256"]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    cache["files"][path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha.hexdigest()}
+    return sha.hexdigest()
+
+
+def fingerprint(sources: list, settings: dict, cache: dict) -> str:
+    """
+    Fingerprint of an artifact: hash of its source files, the
+    settings that affect it and the tool version.
+    """
+    content = {
+        "version": __version__,
+        "sources": [file_hash(source, cache) for source in sources],
+        "settings": settings,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_fresh(cache: dict, artifact: str, key: str) -> bool:
+    """
+    Whether the artifact was produced with the same fingerprint
+    and all its output files still exist.
+    """
+    entry = cache["artifacts"].get(artifact)
+    return bool(entry) and entry["fingerprint"] == key and all(os.path.exists(file) for file in entry["outputs"])
+
+
+def record(cache: dict, artifact: str, key: str, outputs: list) -> None:
+    """
+    Store the fingerprint and output files of a produced artifact.
+    """
+    cache["artifacts"][artifact] = {"fingerprint": key, "outputs": sorted(outputs)}
@@ -1,10 +1,18 @@
 """
 Small I/O helpers for the bbgregressions package.
 """
+import copy
 import os
 import gzip
+import json
+
+import numpy as np
+import pandas as pd
 import yaml
 
+from src.regressions.schema import DEFAULT_TABLE_FORMAT
+from src.utils.profiling import profiled
+
 
 def read_yaml(path: str) -> None:
     """
@@ -14,4 +22,109 @@ def read_yaml(path: str) -> None:
         raise FileNotFoundError(path)
     opener = gzip.open if path.endswith((".gz", ".gzip")) else open
     with opener(path, mode="rt") as fh:
-        return yaml.safe_load(fh)
\ No newline at end of file
+        return yaml.safe_load(fh)
+
+def read_config(config) -> dict:
+    """
+    Config of a stage: read from a YAML file or, when already parsed
+    (e.g. once for the whole pipeline), a copy of it so the updates
+    made by one stage are not seen by the next ones.
+    """
+    if isinstance(config, dict):
+        return copy.deepcopy(config)
+    return read_yaml(config)
+
+TABLE_EXTENSIONS = [".npy", ".tsv"]  # by preference when reading
+
+
+def index_file(path: str) -> str:
+    """
+    Sidecar with the row and column labels of a .npy table.
+    """
+    return f"{os.path.splitext(path)[0]}.index.json"
+
+
+def table_files(stem: str, table_format: str = DEFAULT_TABLE_FORMAT) -> list:
+    """
+    Files write_table writes for a table, the one it is read
+    from first (see list_tables).
+    """
+    files = []
+    if table_format in ["npy", "both"]:
+        files += [f"{stem}.npy", index_file(f"{stem}.npy")]
+    if table_format in ["tsv", "both"]:
+        files.append(f"{stem}.tsv")
+    return files
+
+
+def write_table(data: pd.DataFrame, stem: str, table_format: str = DEFAULT_TABLE_FORMAT) -> list:
+    """
+    Write a table as <stem>.tsv (for humans), as <stem>.npy plus its
+    labels sidecar (binary, memory-mappable) or both. Files of the
+    other format left by previous runs are removed. Returns the
+    paths written.
+    """
+    files = []
+    tsv, npy = f"{stem}.tsv", f"{stem}.npy"
+    if table_format in ["tsv", "both"]:
+        data.to_csv(tsv, sep="\t")
+        files.append(tsv)
+    elif os.path.exists(tsv):
+        os.remove(tsv)
+
+    if table_format in ["npy", "both"]:
+        np.save(npy, data.to_numpy(dtype=float))
+        labels = {
+            "index": data.index.tolist(),
+            "columns": data.columns.tolist(),
+            "index_name": data.index.name,
+            "columns_name": data.columns.name,
+        }
+        with open(index_file(npy), "w") as fh:
+            json.dump(labels, fh)
+        files += [npy, index_file(npy)]
+    else:
+        for file in [npy, index_file(npy)]:
+            if os.path.exists(file):
+                os.remove(file)
+
+    return files
+
+
+@profiled
+def read_table(path: str) -> pd.DataFrame:
+    """
+    Read a table written by write_table. .npy tables are memory-mapped.
+    """
+    if not path.endswith(".npy"):
+        return pd.read_csv(path, sep="\t", index_col=0)
+
+    with open(index_file(path)) as fh:
+        labels = json.load(fh)
+    values = np.load(path, mmap_mode="r")
+    index = pd.Index(labels["index"], name=labels["index_name"])
+    columns = pd.Index(labels["columns"], name=labels["columns_name"])
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def table_sources(path: str) -> list:
+    """
+    Files holding a table (the .npy tables include their sidecar).
+    """
+    if path.endswith(".npy"):
+        return [path, index_file(path)]
+    return [path]
+
+
+def list_tables(directory: str) -> list:
+    """
+    Tables in a directory, one file per table: the .npy one
+    when it was written in both formats.
+    """
+    tables = {}
+    for ext in reversed(TABLE_EXTENSIONS):
+        for file in sorted(os.listdir(directory)):
+            stem, file_ext = os.path.splitext(file)
+            if file_ext == ext:
+                tables[stem] = file
+    return list(tables.values())
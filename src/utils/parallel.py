@@ -0,0 +1,192 @@
+"""
+Process pool helpers for the bbgregressions package.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from src.utils import profiling
+
+# held while forking and by threads running alongside the main one (the
+# background writer) while they work, so processes are never forked while
+# such a thread holds other locks (logging, I/O, allocator)
+FORK_LOCK = threading.RLock()
+
+
+def _reset_fork_lock() -> None:
+    global FORK_LOCK
+    FORK_LOCK = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_reset_fork_lock)
+
+
+def get_context():
+    """
+    Use fork when the platform supports it so workers inherit
+    the parent's memory (e.g. large DataFrames) without pickling it.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def parallel_map(func, tasks: list, jobs: int = 1, initializer=None, initargs: tuple = ()) -> list:
+    """
+    Apply func to every task (tuple of arguments) and return the
+    results in the same order as tasks.
+
+    With jobs > 1 tasks are spread over a process pool; initializer
+    runs once per worker with initargs, which are inherited (fork)
+    or sent once per worker (spawn) instead of once per task.
+    With jobs == 1 everything runs in the current process.
+    When profiling, the stats of the workers are sent back with
+    each result and merged.
+    """
+    return list(parallel_imap(func, tasks, jobs, initializer, initargs))
+
+
+def parallel_imap(func, tasks: list, jobs: int = 1, initializer=None, initargs: tuple = ()):
+    """
+    As parallel_map, but yields the results in task order as they
+    are ready (e.g. to checkpoint them), all from one process pool.
+    """
+    tasks = list(tasks)
+    if jobs <= 1 or len(tasks) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield func(*task)
+        return
+
+    jobs = min(jobs, len(tasks))
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(
+        max_workers=jobs, mp_context=get_context(), initializer=initializer, initargs=initargs
+    ) as pool:
+        # workers are forked when the tasks are submitted
+        with FORK_LOCK:
+            if profiling.is_enabled():
+                outputs = pool.map(profiling.collect, repeat(func), *zip(*tasks), chunksize=chunksize)
+            else:
+                outputs = pool.map(func, *zip(*tasks), chunksize=chunksize)
+        for output in outputs:
+            yield profiling.merge(*output) if profiling.is_enabled() else output
+
+
+def _serve(commands, results, shared: tuple, parent_ends: tuple) -> None:
+    """
+    Loop of the worker of call_with_timeout: runs each call it
+    receives and sends back the outcome, until the caller is gone
+    """
+    # the caller's ends, inherited when forked
+    for conn in parent_ends:
+        conn.close()
+    while True:
+        try:
+            func, args = commands.recv()
+        except EOFError:
+            break
+        try:
+            results.send((None, func(*shared, *args)))
+        except Exception as error:
+            results.send(("error", repr(error)))
+
+
+class TimeoutWorker:
+    """
+    Process running the calls of call_with_timeout, kept between
+    calls. It gets the shared arguments once, when started (inherited
+    when forked), so they are not sent with every call.
+    """
+
+    def __init__(self, shared: tuple):
+        ctx = get_context()
+        commands, self.commands = ctx.Pipe(duplex=False)
+        self.results, results = ctx.Pipe(duplex=False)
+        self.shared = shared
+        self.process = ctx.Process(target=_serve, args=(commands, results, shared, (self.commands, self.results)),
+                                daemon=True)
+        with FORK_LOCK:
+            self.process.start()
+        commands.close()
+        results.close()
+
+    def serves(self, shared: tuple) -> bool:
+        """
+        Whether the worker is alive and started with these (same
+        objects) shared arguments
+        """
+        return (self.process.is_alive() and len(shared) == len(self.shared)
+                and all(arg is own for arg, own in zip(shared, self.shared)))
+
+    def call(self, func, args: tuple, timeout: float = None) -> tuple:
+        """ """
+        self.commands.send((func, args))
+        if not self.results.poll(timeout):
+            return ("timeout", None)
+        return self.results.recv()
+
+    def close(self) -> None:
+        """ """
+        self.commands.close()
+        self.results.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+# worker of call_with_timeout in this process (None until needed)
+TIMEOUT_WORKER = None
+
+
+def _reset_timeout_worker() -> None:
+    # the worker of the parent process is not ours
+    global TIMEOUT_WORKER
+    TIMEOUT_WORKER = None
+
+
+os.register_at_fork(after_in_child=_reset_timeout_worker)
+
+
+def call_with_timeout(func, args: tuple = (), timeout: float = None, shared: tuple = ()) -> tuple:
+    """
+    Run func(*shared, *args) in a separate worker process, which is
+    killed if it has not returned after timeout seconds, so a runaway
+    call cannot stall the caller. The worker is reused by later
+    calls with the same shared arguments (same objects, which must
+    not change meanwhile) and replaced after a timeout or when it
+    dies, so only those calls start a new process.
+
+    Returns (reason, result): reason is None on success, "timeout"
+    if the process was killed or "error" if func raised (result is
+    then the error message) or the process died.
+    """
+    global TIMEOUT_WORKER
+    if TIMEOUT_WORKER is not None and not TIMEOUT_WORKER.serves(shared):
+        close_timeout_worker()
+    if TIMEOUT_WORKER is None:
+        TIMEOUT_WORKER = TimeoutWorker(shared)
+
+    try:
+        reason, result = TIMEOUT_WORKER.call(func, args, timeout)
+    except (EOFError, OSError):
+        reason, result = "error", "process exited without a result"
+        close_timeout_worker()
+    if reason == "timeout":
+        close_timeout_worker()
+
+    return (reason, result)
+
+
+def close_timeout_worker() -> None:
+    """
+    Stops the worker of call_with_timeout (if any), e.g. to release
+    its shared arguments once no more calls are expected
+    """
+    global TIMEOUT_WORKER
+    if TIMEOUT_WORKER is not None:
+        TIMEOUT_WORKER.close()
+        TIMEOUT_WORKER = None
@@ -0,0 +1,195 @@
+"""
+Opt-in profiling of a run (--profile): wall time, calls and peak
+RSS of the stages and hot functions, and latency histograms of the
+model fits, written as a JSON run report. While profiling is off,
+the hooks only check a flag.
+"""
+import bisect
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from src import __version__
+
+# upper edges (seconds) of the fit latency histogram bins, the last bin is open
+FIT_BINS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+PROFILE = {"enabled": False, "timers": {}, "fits": {}, "workers_peak_rss_mb": 0.0}
+
+
+def enable() -> None:
+    """
+    Starts profiling, from empty stats.
+    """
+    PROFILE.update(enabled=True, timers={}, fits={}, workers_peak_rss_mb=0.0)
+
+
+def is_enabled() -> bool:
+    return PROFILE["enabled"]
+
+
+def peak_rss_mb(who: str = "self") -> float:
+    """
+    Peak resident memory (MB) of this process ("self") or of its
+    finished child processes ("children"). NA without resource.
+    """
+    if resource is None:
+        return float("nan")
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def add_time(name: str, seconds: float) -> None:
+    """
+    Adds a call of seconds to the timer of name, with the peak RSS
+    of the process when it ended.
+    """
+    stats = PROFILE["timers"].setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss_mb": 0.0})
+    stats["calls"] += 1
+    stats["seconds"] += seconds
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak_rss_mb())
+
+
+@contextmanager
+def timer(name: str):
+    """
+    Times the block under name (when profiling).
+    """
+    if not PROFILE["enabled"]:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def profiled(func):
+    """
+    Times every call of func (when profiling), under its module
+    and name (e.g. regressions.utils.fill_storage).
+    """
+    name = f"{func.__module__.removeprefix('src.')}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE["enabled"]:
+            return func(*args, **kwargs)
+        with timer(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def record_fit(model: str, seconds: float, count: int = 1) -> None:
+    """
+    Adds the latency of count fits of model (seconds each) to its
+    histogram.
+    """
+    stats = PROFILE["fits"].setdefault(model, {"count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                            "histogram": [0] * (len(FIT_BINS) + 1)})
+    stats["count"] += count
+    stats["seconds"] += seconds * count
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    stats["histogram"][bisect.bisect_left(FIT_BINS, seconds)] += count
+
+
+def collect(func, *args) -> tuple:
+    """
+    Runs func in a worker process with profiling on and empty stats
+    (not those inherited from the parent), and returns its result
+    with the stats, to be merged by the parent.
+    """
+    saved = {key: PROFILE[key] for key in ["timers", "fits", "workers_peak_rss_mb"]}
+    enable()
+    try:
+        result = func(*args)
+        stats = {"timers": PROFILE["timers"], "fits": PROFILE["fits"],
+                "workers_peak_rss_mb": max(PROFILE["workers_peak_rss_mb"], peak_rss_mb())}
+    finally:
+        PROFILE.update(saved)
+
+    return (result, stats)
+
+
+def merge(result, stats: dict):
+    """
+    Adds the stats sent back by a worker (see collect) and returns
+    its result.
+    """
+    for name, worker in stats["timers"].items():
+        own = PROFILE["timers"].setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss_mb": 0.0})
+        own["calls"] += worker["calls"]
+        own["seconds"] += worker["seconds"]
+        own["max_seconds"] = max(own["max_seconds"], worker["max_seconds"])
+        own["peak_rss_mb"] = max(own["peak_rss_mb"], worker["peak_rss_mb"])
+    for model, worker in stats["fits"].items():
+        own = PROFILE["fits"].setdefault(model, {"count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                "histogram": [0] * (len(FIT_BINS) + 1)})
+        own["count"] += worker["count"]
+        own["seconds"] += worker["seconds"]
+        own["max_seconds"] = max(own["max_seconds"], worker["max_seconds"])
+        own["histogram"] = [a + b for a, b in zip(own["histogram"], worker["histogram"])]
+    PROFILE["workers_peak_rss_mb"] = max(PROFILE["workers_peak_rss_mb"], stats["workers_peak_rss_mb"])
+
+    return result
+
+
+def report(command: str, params: dict, seconds: float) -> dict:
+    """
+    Run report: timers (inclusive of the timed calls they make,
+    slowest first), fit latencies per model and peak memory.
+    """
+    timers = dict(sorted(PROFILE["timers"].items(), key=lambda item: item[1]["seconds"], reverse=True))
+    fits = {}
+    for model, stats in PROFILE["fits"].items():
+        fits[model] = {
+            "count": stats["count"],
+            "seconds": stats["seconds"],
+            "mean_seconds": stats["seconds"] / stats["count"],
+            "max_seconds": stats["max_seconds"],
+            "histogram": {
+                "bins": [f"<={edge}s" for edge in FIT_BINS] + [f">{FIT_BINS[-1]}s"],
+                "counts": stats["histogram"],
+            },
+        }
+
+    return {
+        "command": command,
+        "version": __version__,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "argv": sys.argv,
+        "params": params,
+        "wall_seconds": seconds,
+        "peak_rss_mb": {
+            "main": peak_rss_mb(),
+            "children": peak_rss_mb("children"),
+            "workers": PROFILE["workers_peak_rss_mb"],
+        },
+        "timers": timers,
+        "fits": fits,
+    }
+
+
+def write_report(file: str, command: str, params: dict, seconds: float) -> dict:
+    """
+    Writes the run report as JSON and returns it.
+    """
+    run_report = report(command, params, seconds)
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    with open(file, "w") as fh:
+        json.dump(run_report, fh, indent=1, default=str)
+
+    return run_report
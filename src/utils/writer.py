@@ -0,0 +1,52 @@
+"""
+Background writer so pipeline stages can hand their results to the
+next stage in memory while the artifacts are written to disk.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import parallel
+
+
+def _locked(func, *args, **kwargs):
+    """
+    Runs a write task while holding the fork lock, so the process
+    pools of the stages are not forked in the middle of a write
+    """
+    with parallel.FORK_LOCK:
+        return func(*args, **kwargs)
+
+
+class BackgroundWriter:
+    """
+    Runs write tasks one at a time, in the order they were submitted,
+    on a background thread. Tasks submitted after a write can rely
+    on its files (e.g. to fingerprint them). Errors are raised when
+    waiting for the pending tasks. Process pools (parallel_map) are
+    only forked between writes.
+    """
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self.pending = []
+
+    def submit(self, func, *args, **kwargs):
+        future = self.pool.submit(_locked, func, *args, **kwargs)
+        self.pending.append(future)
+        return future
+
+    def wait(self) -> None:
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
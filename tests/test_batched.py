@@ -0,0 +1,78 @@
+"""
+Vectorized engine (batched fits) against statsmodels.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.regressions import models
+from src.regressions.batched import mixedlm
+from src.regressions.utils import init_storage
+
+ELEMENTS = [f"GENE{i}" for i in range(30)]
+PREDICTORS = ["age", "bmi", "is_1"]
+
+
+def linear_data(seed: int = 0, n_samples: int = 60) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({"age": rng.normal(size=n_samples), "bmi": rng.normal(size=n_samples),
+                        "is_1": rng.integers(0, 2, n_samples).astype(float)})
+    data.loc[rng.random(n_samples) < 0.1, "bmi"] = np.nan
+    values = 1 + 0.5 * data[["age"]].to_numpy() + rng.normal(size=(n_samples, len(ELEMENTS)))
+    # columns with no, shared and own missing values
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:, :10] = rng.normal(size=(n_samples, 10))
+    values[:5, 10:20] = np.nan
+    return data.join(pd.DataFrame(values, columns=ELEMENTS))
+
+
+@pytest.mark.parametrize("mode", ["uni", "multi"])
+def test_vectorized_linear_matches_statsmodels(mode):
+    data = linear_data()
+    if mode == "uni":
+        predictors = PREDICTORS
+    elif mode == "multi":
+        predictors = ["age+bmi" if i % 2 else "age+bmi+is_1" for i in range(len(ELEMENTS))]
+    results = {}
+    for engine in ["statsmodels", "vectorized"]:
+        config = {"model": "linear", "engine": engine, "predictors": PREDICTORS, "predictors_intercept_0": ["is_1"],
+                "correct_pvals": True, "fit_timeout": None}
+        results[engine] = models.main(data, init_storage(ELEMENTS, PREDICTORS), ELEMENTS, predictors, config,
+                                    mode=mode)
+
+    for res_elem in results["statsmodels"]:
+        np.testing.assert_allclose(results["vectorized"][res_elem], results["statsmodels"][res_elem],
+                                rtol=1e-10, atol=1e-12)
+    np.testing.assert_array_equal(results["vectorized"].no_intercept, results["statsmodels"].no_intercept)
+
+
+def random_effect_data(seed: int = 5, n_samples: int = 40) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({"SUBJECT_ID": rng.integers(0, 13, n_samples),
+                        "is_1": rng.integers(0, 2, n_samples).astype(float)})
+    values = rng.gamma(2, 1, (n_samples, len(ELEMENTS)))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    return data.join(pd.DataFrame(values, columns=ELEMENTS))
+
+
+def test_linear_me_batch_refits_failed_elements_as_statsmodels():
+    data = random_effect_data()
+    config = {"model": "linear-mixed-effects", "predictor_random_effect": "SUBJECT_ID", "fit_timeout": None}
+    groups = models.random_effect_groups(data, config)
+    X = data[["is_1"]].assign(Intercept=1.0).to_numpy()
+    failed = np.flatnonzero(mixedlm(X, data[ELEMENTS].to_numpy(), groups)["failed"])
+    assert len(failed)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        res = models.linear_me_batch(data, ELEMENTS, "is_1", " + 1", config, groups)
+        diagnostics = []
+        for i in failed:
+            summary, reason = models.run_fit(data, f"{ELEMENTS[i]} ~ is_1 + 1", config)
+            if reason:
+                diagnostics.append((ELEMENTS[i], "is_1", reason))
+            for stat in ["params", "pvalues"]:
+                np.testing.assert_array_equal(res[stat][i], summary[stat][res["terms"]].to_numpy())
+    assert res["diagnostics"] == diagnostics
@@ -0,0 +1,23 @@
+"""
+The vectorized cleaner gives the same tables as its previous
+(apply-based) version.
+"""
+import pandas as pd
+import pytest
+
+from benchmarks.generators import cleaner_table
+from benchmarks.stages import apply_clean_reps, apply_handle_nan
+from src.create_input.cleaner import clean_reps, handle_nan
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_clean_reps_matches_reference(seed):
+    data = cleaner_table(300, 50, na_rate=0.3, seed=seed)
+    pd.testing.assert_frame_equal(clean_reps(data), apply_clean_reps(data), check_exact=True)
+
+
+@pytest.mark.parametrize("option", ["ignore", "mean", "cohort"])
+def test_handle_nan_matches_reference(option):
+    data = cleaner_table(300, 50, na_rate=0.3)
+    config = {"handle_na": option}
+    pd.testing.assert_frame_equal(handle_nan(data, config), apply_handle_nan(data, config), check_exact=True)
@@ -0,0 +1,43 @@
+"""
+The CLI only imports the heavy libraries of a command when it runs,
+so `bbgregressions -h` and the shell completion start fast.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# seconds to import the CLI (about 0.1 s when the heavy imports are lazy)
+IMPORT_BUDGET = 0.5
+HEAVY_MODULES = ["pandas", "numpy", "statsmodels", "matplotlib", "seaborn", "scipy"]
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                        check=True)
+
+
+def test_cli_does_not_import_heavy_modules():
+    code = f"import json, sys, src.main; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    assert json.loads(run_python(code).stdout) == []
+
+
+def test_cli_import_time_budget():
+    # best of a few runs, so a busy machine does not fail the test
+    times = []
+    for _ in range(3):
+        report = run_python("import src.main", "-X", "importtime").stderr
+        # last line: cumulative microseconds of src.main
+        line = [line for line in report.splitlines() if line.rstrip().endswith("| src.main")][-1]
+        times.append(int(line.split("|")[1]) / 1e6)
+    assert min(times) < IMPORT_BUDGET, f"importing the CLI took {min(times):.3f}s (budget {IMPORT_BUDGET}s)"
+
+
+def test_model_options_match_models():
+    from src.regressions.models import BATCH_MODELS, MODELS
+    from src.regressions.schema import MODEL_OPTIONS
+
+    assert list(MODELS) == MODEL_OPTIONS
+    assert list(BATCH_MODELS) == MODEL_OPTIONS
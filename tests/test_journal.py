@@ -0,0 +1,90 @@
+"""
+Checkpoints of the model fits (regressions --resume).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.regressions import models
+from src.regressions.utils import init_storage, load_journal, write_results
+
+ELEMENTS = [f"G{i}" for i in range(6)]
+PREDICTORS = ["age", "bmi"]
+
+
+def model_data(seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.normal(size=(40, len(PREDICTORS))), columns=PREDICTORS)
+    for element in ELEMENTS:
+        data[element] = 1 + data["age"] * 0.5 + rng.normal(size=len(data))
+    return data
+
+
+def model_config(engine: str = "statsmodels") -> dict:
+    return {"model": "linear", "engine": engine, "predictors": PREDICTORS, "predictors_intercept_0": ["bmi"],
+            "correct_pvals": True, "fit_timeout": None}
+
+
+def run(data, journal, resume=False, engine="statsmodels"):
+    results = init_storage(ELEMENTS, PREDICTORS)
+    return models.main(data, results, ELEMENTS, PREDICTORS, model_config(engine), mode="uni",
+                    journal=str(journal), resume=resume)
+
+
+@pytest.mark.parametrize("engine", ["statsmodels", "vectorized"])
+def test_resume_reuses_complete_journal(tmp_path, monkeypatch, engine):
+    journal = tmp_path / "journal.uni.npz"
+    first = run(model_data(), journal, engine=engine)
+
+    # no fit may run again
+    monkeypatch.setattr(models, "fit", None)
+    monkeypatch.setattr(models, "BATCH_MODELS", {})
+    resumed = run(model_data(), journal, resume=True, engine=engine)
+    for res_elem in first:
+        np.testing.assert_array_equal(resumed[res_elem], first[res_elem])
+
+
+@pytest.mark.parametrize("engine", ["statsmodels", "vectorized"])
+def test_resume_ignores_journal_of_other_data_or_settings(tmp_path, engine):
+    journal = tmp_path / "journal.uni.npz"
+    run(model_data(), journal, engine=engine)
+
+    # edited input: fits are run again, not taken from the journal
+    resumed = run(model_data(seed=1), journal, resume=True, engine=engine)
+    fresh = run(model_data(seed=1), tmp_path / "fresh.npz", engine=engine)
+    for res_elem in fresh:
+        np.testing.assert_array_equal(resumed[res_elem], fresh[res_elem])
+
+    # edited settings
+    config = dict(model_config(engine), predictors_intercept_0=["age"])
+    key = models.journal_key(model_data(seed=1), config, "uni", ELEMENTS, PREDICTORS)
+    _, done, complete = load_journal(init_storage(ELEMENTS, PREDICTORS), str(journal), key)
+    assert not complete and not done.any()
+
+
+def test_checkpoints_are_throttled(tmp_path, monkeypatch):
+    saves = []
+    monkeypatch.setattr(models, "save_journal", lambda *args, **kwargs: saves.append(kwargs.get("complete", False)))
+    run(model_data(), tmp_path / "journal.uni.npz")
+    # only the final checkpoint of a run shorter than CHECKPOINT_SECONDS
+    assert saves == [True]
+
+    saves.clear()
+    monkeypatch.setattr(models, "CHECKPOINT_SECONDS", 0)
+    run(model_data(), tmp_path / "journal.uni.npz")
+    assert saves[-1] and len(saves) == len(ELEMENTS) * len(PREDICTORS) + 1
+
+
+def test_intercepts_written_by_model_design(tmp_path):
+    results = run(model_data(), tmp_path / "journal.uni.npz")
+    # a fitted intercept that happens to be 0.0 is not taken as forced through zero
+    results["intercept"][0, 0] = 0.0
+    write_results(results, str(tmp_path))
+    intercepts = pd.read_csv(tmp_path / "intercept.tsv", sep="\t", index_col=0, dtype=str)
+    assert intercepts.loc["G0", "age"] == "0.0"
+    assert (intercepts["bmi"] == "0").all()
+
+
+def test_unknown_engine_fails(tmp_path):
+    with pytest.raises(IOError, match="Unknown engine"):
+        run(model_data(), tmp_path / "journal.uni.npz", engine="vectorised")
@@ -0,0 +1,29 @@
+"""
+Reading of the source tables (create_input).
+"""
+import pandas as pd
+
+from src.create_input import selection
+from src.create_input.loader import read_source
+
+
+def test_levels_skip_missing_values(tmp_path):
+    file = tmp_path / "omega.tsv"
+    pd.DataFrame({"gene": ["TP53", None, "KRAS--1", "TP53"], "sample": ["S1", "S2", None, "S1"],
+                "dnds": [1.0, 2.0, 3.0, 4.0]}).to_csv(file, sep="\t", index=False)
+    dtypes = {"gene": "category", "sample": "category", "dnds": "float64"}
+
+    data, levels = read_source(str(file), dtypes, levels=["gene", "sample"])
+    assert len(data) == 4
+    assert levels == {"gene": ["TP53", "KRAS--1"], "sample": ["S1", "S2"]}
+    # as for the default omega elements
+    assert [gene for gene in levels["gene"] if "--" not in gene] == ["TP53"]
+
+
+def test_selection_matches_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(selection, "MATCHES", {})
+    monkeypatch.setattr(selection, "MAX_MATCHES", 3)
+    for i in range(10):
+        mask = selection.match_values(["TP53", "KRAS", "A"], ["TP*", "A"], key=(f"file{i}", "gene"))
+        assert mask.tolist() == [True, False, True]
+    assert [key for key, _ in selection.MATCHES] == [("file7", "gene"), ("file8", "gene"), ("file9", "gene")]
@@ -0,0 +1,117 @@
+"""
+regressions --shard i/N and merge give the results of an unsharded
+run, on a small synthetic dataset.
+"""
+import copy
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from benchmarks.generators import write_dataset
+from src.create_input.main import main as create_input_main
+from src.regressions.main import main as regressions_main
+from src.regressions.merge import main as merge_main
+from src.utils.io import list_tables
+
+N_SHARDS = 3
+
+
+def result_tables(output_dir: str) -> dict:
+    """
+    Content of the result tables by path (relative to the results)
+    """
+    results_dir = os.path.join(output_dir, "regressions")
+    tables = {}
+    for root, _, files in os.walk(results_dir):
+        for file in files:
+            if file.endswith(".tsv"):
+                with open(os.path.join(root, file)) as fh:
+                    tables[os.path.relpath(os.path.join(root, file), results_dir)] = fh.read()
+    return tables
+
+
+def with_output(config: dict, output_dir: str) -> dict:
+    config = copy.deepcopy(config)
+    config["general"]["output_dir"] = output_dir
+    return config
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    """
+    Config with its input tables created, and the tables of an
+    unsharded run of it
+    """
+    directory = tmp_path_factory.mktemp("shards")
+    config = write_dataset(str(directory), n_elements=20, n_samples=30, n_predictors=3, seed=1)
+    create_input_main(config)
+
+    unsharded = with_output(config, str(directory / "unsharded"))
+    shutil.copytree(os.path.join(config["general"]["output_dir"], "input"),
+                    os.path.join(unsharded["general"]["output_dir"], "input"))
+    regressions_main(unsharded)
+
+    return (config, result_tables(unsharded["general"]["output_dir"]))
+
+
+def sharded_run(config: dict, tmp_path) -> dict:
+    """
+    Copy of the config, output in tmp_path, with the input tables
+    """
+    run_config = with_output(config, str(tmp_path / "output"))
+    shutil.copytree(os.path.join(config["general"]["output_dir"], "input"),
+                    os.path.join(run_config["general"]["output_dir"], "input"))
+    return run_config
+
+
+def shard_files(config: dict) -> list:
+    output_dir = os.path.join(config["general"]["output_dir"], "regressions", config["general"]["model"])
+    return sorted(os.path.join(root, file) for root, _, files in os.walk(output_dir)
+                for file in files if file.startswith("shard."))
+
+
+def test_merge_matches_unsharded_run(dataset, tmp_path):
+    config, expected = dataset
+    config = sharded_run(config, tmp_path)
+    for i in range(1, N_SHARDS + 1):
+        regressions_main(config, shard=(i, N_SHARDS))
+    inputs = list_tables(os.path.join(config["general"]["output_dir"], "input"))
+    assert len(shard_files(config)) == N_SHARDS * len(inputs)
+    merge_main(config)
+
+    tables = result_tables(config["general"]["output_dir"])
+    assert any(path.endswith(os.path.join("univariate", "qval.tsv")) for path in tables)
+    assert any(path.endswith(os.path.join("multivariate", "qval.tsv")) for path in tables)
+    assert tables == expected
+    assert shard_files(config) == []
+
+
+def test_merge_fails_with_missing_shard(dataset, tmp_path):
+    config = sharded_run(dataset[0], tmp_path)
+    for i in [1, 3]:
+        regressions_main(config, shard=(i, N_SHARDS))
+    with pytest.raises(IOError, match="Missing shards"):
+        merge_main(config)
+
+
+def test_merge_fails_with_shards_of_different_runs(dataset, tmp_path):
+    config = sharded_run(dataset[0], tmp_path)
+    for i in range(1, N_SHARDS + 1):
+        regressions_main(config, shard=(i, N_SHARDS))
+    regressions_main(config, shard=(1, N_SHARDS + 1), force=True)
+    with pytest.raises(IOError, match="Shards of different runs"):
+        merge_main(config)
+
+
+def test_merge_fails_with_unfinished_shard(dataset, tmp_path):
+    config = sharded_run(dataset[0], tmp_path)
+    for i in range(1, N_SHARDS + 1):
+        regressions_main(config, shard=(i, N_SHARDS))
+    shard = shard_files(config)[0]
+    journal = dict(np.load(shard))
+    journal["complete"] = np.array(False)
+    np.savez(shard, **journal)
+    with pytest.raises(IOError, match="Unfinished shard"):
+        merge_main(config)
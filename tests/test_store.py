@@ -0,0 +1,125 @@
+"""
+Results store: lookups, results as the plots read them and
+freshness of the stored results.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.plot.utils import regressions_reader
+from src.regressions.store import (build_store, is_stored, mode_key, query, record_keys, results_frames, results_keys,
+                                   stored_modes, write_store)
+from src.regressions.utils import correct_pvals, init_storage, write_results
+from src.utils.cache import load_cache, record, save_cache
+
+ELEMENTS = ["TP53", "NOTCH1", "KMT2D", "ALL_GENES"]
+PREDICTORS = ["age", "is_male"]
+
+
+def mode_results(corrected: bool = True, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    results = init_storage(ELEMENTS, PREDICTORS)
+    shape = (len(ELEMENTS), len(PREDICTORS))
+    results["coeff"] = rng.normal(size=shape)
+    results["low_ci"] = results["coeff"] - 1
+    results["high_ci"] = results["coeff"] + 1
+    results["pval"] = rng.random(shape) / 10
+    results["intercept"] = rng.normal(size=shape)
+    # a fit that failed and an element without results
+    results["coeff"][0, 1] = results["pval"][0, 1] = np.nan
+    for res_elem in results:
+        results[res_elem][2] = np.nan
+    return correct_pvals(results) if corrected else results
+
+
+def write_mode(output_dir, results, metric: str = "mutdensity_mb.all", mode: str = "univariate") -> str:
+    mode_dir = os.path.join(output_dir, "regressions", "linear", metric, mode)
+    os.makedirs(mode_dir, exist_ok=True)
+    write_results(results, mode_dir)
+    return mode_dir
+
+
+@pytest.fixture
+def store(tmp_path):
+    file = str(tmp_path / "regressions" / "results.sqlite")
+    for metric in ["mutdensity_mb.all", "omega.all"]:
+        results = mode_results(seed=len(metric))
+        write_store(file, write_mode(tmp_path, results, metric), results)
+    return file
+
+
+def test_query_filters(store):
+    data = query(store)
+    # elements without any result are not stored
+    assert len(data) == 2 * 3 * len(PREDICTORS)
+    assert "KMT2D" not in data["element"].tolist()
+
+    data = query(store, metric="omega.all", elements=["TP53", "ALL_GENES"], predictors="age")
+    assert data[["metric", "element", "predictor"]].values.tolist() == [
+        ["omega.all", "TP53", "age"], ["omega.all", "ALL_GENES", "age"]]
+
+    significant = query(store, max_sign=0.05)
+    assert (significant["qval"] < 0.05).all()
+    assert len(significant) == (query(store)["qval"] < 0.05).sum()
+
+
+@pytest.mark.parametrize("corrected", [True, False])
+def test_results_frames_match_result_tables(tmp_path, corrected):
+    file = str(tmp_path / "results.sqlite")
+    results = mode_results(corrected)
+    if corrected:
+        # q-values computed, none of them available
+        results["qval"][:] = np.nan
+    mode_dir = write_mode(tmp_path, results)
+    write_store(file, mode_dir, results)
+
+    expected = regressions_reader(mode_dir)
+    frames = results_frames(file, "linear", "mutdensity_mb.all", "univariate")
+    assert sorted(frames) == sorted(expected)
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(frames[name], frame, check_names=False, check_dtype=False,
+                                    check_index_type=not frame.empty)
+
+
+def record_regressions(output_dir, metric: str, key: str, mode_dirs: list) -> None:
+    # as regressions records the results of an input file
+    cache = load_cache(output_dir, "regressions")
+    outputs = [os.path.join(mode_dir, file) for mode_dir in mode_dirs for file in os.listdir(mode_dir)]
+    record(cache, f"linear/{metric}.tsv", key, outputs)
+    save_cache(output_dir, "regressions", cache)
+
+
+def test_build_store_adds_stale_modes(tmp_path):
+    file = str(tmp_path / "regressions" / "results.sqlite")
+    metrics = ["mutdensity_mb.all", "omega.all"]
+    mode_dirs = [write_mode(tmp_path, mode_results(), metric) for metric in metrics]
+    for metric, mode_dir in zip(metrics, mode_dirs):
+        record_regressions(tmp_path, metric, "run1", [mode_dir])
+    assert build_store(file, mode_dirs, results_keys(tmp_path)) == 2
+    assert build_store(file, mode_dirs, results_keys(tmp_path)) == 0
+    assert build_store(file, mode_dirs, results_keys(tmp_path), force=True) == 2
+
+    # results of one input file rerun (here without the store)
+    results = mode_results(seed=1)
+    write_mode(tmp_path, results, metrics[0])
+    record_regressions(tmp_path, metrics[0], "run2", [mode_dirs[0]])
+    modes = stored_modes(file, results_keys(tmp_path))
+    assert not is_stored(modes, mode_dirs[0])
+    assert is_stored(modes, mode_dirs[1])
+    assert build_store(file, mode_dirs, results_keys(tmp_path)) == 1
+    stored = query(file, metric=metrics[0]).dropna(subset=["qval"])
+    assert np.allclose(stored["qval"], results["qval"][~np.isnan(results["qval"])])
+
+
+def test_written_results_are_current_once_recorded(tmp_path):
+    file = str(tmp_path / "regressions" / "results.sqlite")
+    results = mode_results()
+    mode_dir = write_mode(tmp_path, results)
+    write_store(file, mode_dir, results)
+    record_regressions(tmp_path, "mutdensity_mb.all", "run1", [mode_dir])
+    assert not is_stored(stored_modes(file, results_keys(tmp_path)), mode_dir)
+
+    record_keys(file, {mode_key(mode_dir): "run1"})
+    assert is_stored(stored_modes(file, results_keys(tmp_path)), mode_dir)
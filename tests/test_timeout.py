@@ -0,0 +1,60 @@
+"""
+Fits over the time budget (fit_timeout).
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.regressions import models
+from src.regressions.utils import init_storage, write_results
+from src.utils import parallel
+
+ELEMENTS = [f"G{i}" for i in range(4)]
+PREDICTORS = ["age", "bmi"]
+
+
+def slow_linear(data, formula, config):
+    if formula.startswith("G1 "):
+        time.sleep(30)
+    return models.linear(data, formula, config)
+
+
+def worker_pid(data, wait: float = 0) -> int:
+    time.sleep(wait)
+    return os.getpid()
+
+
+def test_slow_fit_is_reported_as_timeout(tmp_path, monkeypatch):
+    monkeypatch.setitem(models.MODELS, "linear", slow_linear)
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(30, len(PREDICTORS) + len(ELEMENTS))), columns=PREDICTORS + ELEMENTS)
+    config = {"model": "linear", "engine": "statsmodels", "predictors": PREDICTORS, "predictors_intercept_0": ["bmi"],
+            "correct_pvals": True, "fit_timeout": 2}
+
+    start = time.monotonic()
+    results = models.main(data, init_storage(ELEMENTS, PREDICTORS), ELEMENTS, PREDICTORS, config, mode="uni")
+    assert time.monotonic() - start < 20
+    assert np.isnan(results["coeff"][1]).all()
+    assert np.isfinite(np.delete(results["coeff"], 1, axis=0)).all()
+
+    write_results(results, str(tmp_path))
+    diagnostics = pd.read_csv(tmp_path / "diagnostics.tsv", sep="\t")
+    assert diagnostics.values.tolist() == [["G1", "age", "timeout"], ["G1", "bmi", "timeout"]]
+    assert parallel.TIMEOUT_WORKER is None
+
+
+def test_worker_is_reused_until_timeout():
+    data = pd.DataFrame({"x": [1.0]})
+    pid = parallel.call_with_timeout(worker_pid, (), 10, shared=(data,))[1]
+    assert pid != os.getpid()
+    assert parallel.call_with_timeout(worker_pid, (), 10, shared=(data,)) == (None, pid)
+
+    assert parallel.call_with_timeout(worker_pid, (5,), 0.5, shared=(data,)) == ("timeout", None)
+    new_pid = parallel.call_with_timeout(worker_pid, (), 10, shared=(data,))[1]
+    assert new_pid not in [pid, None]
+
+    # other shared data, other worker
+    assert parallel.call_with_timeout(worker_pid, (), 10, shared=(data.copy(),))[1] != new_pid
+    parallel.close_timeout_worker()